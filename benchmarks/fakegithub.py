@@ -0,0 +1,364 @@
+"""
+Local stand-in for the github v3 api with a synthetic, deterministic world.
+
+Users are "user0" .. "user<N-1>", organisations "org0" .. "org<M-1>".
+Every user and organisation owns a few repos "<login>/repo<i>", some of them forks,
+repos have contributors, users and organisations have push events.
+Lists are paginated with `Link` headers like github does (default 30, max 100 per page)
+and every response carries the X-RateLimit-* headers and an ETag.
+A matching If-None-Match gets a 304 that does not count against the rate limit.
+"""
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeGithubWorld(object):
+
+    def __init__(self, num_users=2000, num_orgs=100, max_repos=8, max_contributors=10,
+                 num_events=30, num_members=20, seed=23):
+        self.num_users = num_users
+        self.num_orgs = num_orgs
+        self.max_repos = max_repos
+        self.max_contributors = max_contributors
+        self.num_events = num_events
+        self.num_members = num_members
+        self.seed = seed
+        self.base_url = "http://localhost/"
+        # login -> events added by push_event(), newest first
+        self._new_events = dict()
+        self._lock = threading.Lock()
+
+    def _rng(self, *key):
+        return random.Random("%s/%s" % (self.seed, "/".join(str(k) for k in key)))
+
+    def _index(self, login, prefix, count):
+        if login.startswith(prefix) and login[len(prefix):].isdigit():
+            i = int(login[len(prefix):])
+            if i < count:
+                return i
+        return None
+
+    def is_user(self, login):
+        return self._index(login, "user", self.num_users) is not None
+
+    def is_org(self, login):
+        return self._index(login, "org", self.num_orgs) is not None
+
+    def _owner(self, login):
+        url = "https://api.github.com/users/%s" % login
+        return dict({
+            "login": login,
+            "id": _id(login),
+            "node_id": "MDQ6VXNlcj%08x" % _id(login),
+            "type": "Organization" if self.is_org(login) else "User",
+            "avatar_url": "https://avatars.example.com/%s" % login,
+            "gravatar_id": "",
+            "url": url,
+            "html_url": "https://github.com/%s" % login,
+            "site_admin": False,
+        }, **{"%s_url" % name: url + path for name, path in _OWNER_URLS})
+
+    def _random_user(self, rng):
+        return "user%s" % rng.randrange(self.num_users)
+
+    def user(self, login):
+        rng = self._rng("user", login)
+        return dict(self._owner(login), **{
+            "name": login.title(),
+            "html_url": "https://github.com/%s" % login,
+            "location": rng.choice(["Berlin", "Paris", "Tokyo", "Lagos", None]),
+            "company": None,
+            "public_repos": len(self.repo_names(login)),
+            "followers": rng.randrange(500),
+            "following": rng.randrange(100),
+            "created_at": "2015-01-01T00:00:00Z",
+        })
+
+    def org(self, login):
+        return dict(self._owner(login), **{
+            "name": login.upper(),
+            "members_url": self.base_url + "orgs/%s/members{/member}" % login,
+            "public_repos": len(self.repo_names(login)),
+        })
+
+    def repo_names(self, login):
+        return ["repo%s" % i for i in range(self._rng("repos", login).randrange(self.max_repos + 1))]
+
+    def repo(self, login, name):
+        if name not in self.repo_names(login):
+            return None
+        rng = self._rng("repo", login, name)
+        fork = rng.random() < .2
+        repo = {
+            "id": _id(login + "/" + name),
+            "name": name,
+            "full_name": "%s/%s" % (login, name),
+            "owner": self._owner(login),
+            "fork": fork,
+            "description": "synthetic repository %s" % name,
+            "language": rng.choice(["Python", "C", "JavaScript", "Go", None]),
+            "stargazers_count": int(rng.paretovariate(1.2)) - 1,
+            "watchers_count": rng.randrange(50),
+            "forks_count": rng.randrange(20),
+            "open_issues_count": rng.randrange(30),
+            "size": rng.randrange(100000),
+            "node_id": "MDEwOlJlcG9zaXRvcnk%08x" % _id(login + "/" + name),
+            "private": False,
+            "url": "https://api.github.com/repos/%s/%s" % (login, name),
+            "html_url": "https://github.com/%s/%s" % (login, name),
+            "homepage": None,
+            "default_branch": "master",
+            "has_issues": True, "has_projects": True, "has_wiki": True, "has_pages": False, "has_downloads": True,
+            "archived": False, "disabled": False, "license": None,
+            "created_at": "2016-01-01T00:00:00Z",
+            "updated_at": "2020-01-01T00:00:00Z",
+            "pushed_at": "2020-01-01T00:00:00Z",
+        }
+        repo.update({
+            "%s_url" % name_: "https://api.github.com/repos/%s/%s%s" % (login, name, path)
+            for name_, path in _REPO_URLS
+        })
+        if fork:
+            source_login = self._random_user(rng)
+            source_names = self.repo_names(source_login)
+            if source_names:
+                source = {"owner": self._owner(source_login), "name": source_names[0],
+                          "full_name": "%s/%s" % (source_login, source_names[0]), "fork": False}
+                repo["source"] = repo["parent"] = source
+            else:
+                repo["fork"] = False
+        return repo
+
+    def repo_list(self, login):
+        return [self.repo(login, name) for name in self.repo_names(login)]
+
+    def contributors(self, login, name):
+        rng = self._rng("contributors", login, name)
+        logins = {login} if self.is_user(login) else set()
+        logins.update(self._random_user(rng) for i in range(rng.randrange(self.max_contributors)))
+        return [
+            {"login": user, "id": _id(user), "type": "User", "contributions": rng.randrange(1, 200)}
+            for user in sorted(logins)
+        ]
+
+    def events(self, login):
+        rng = self._rng("events", login)
+        events = []
+        for i in range(self.num_events):
+            owner = self._random_user(rng)
+            names = self.repo_names(owner)
+            if names:
+                events.append({
+                    "id": str(10 ** 9 - i),
+                    "type": rng.choice(["PushEvent", "PushEvent", "IssueCommentEvent", "WatchEvent"]),
+                    "actor": self._owner(login),
+                    "repo": {"name": "%s/%s" % (owner, rng.choice(names))},
+                    "payload": self._payload(login, i),
+                    "public": True,
+                    "created_at": "2020-01-01T00:00:00Z",
+                })
+        with self._lock:
+            return self._new_events.get(login, []) + events
+
+    def push_event(self, login, repo_full_name, type="PushEvent"):
+        """Adds a new event at the top of the events of login"""
+        with self._lock:
+            num_events = sum(len(events) for events in self._new_events.values())
+            event = {
+                "id": str(10 ** 9 + 1 + num_events),
+                "type": type,
+                "actor": self._owner(login),
+                "repo": {"name": repo_full_name},
+                "payload": self._payload(login, -1 - num_events),
+                "public": True,
+                "created_at": "2021-01-01T00:00:00Z",
+            }
+            self._new_events.setdefault(login, []).insert(0, event)
+        return event
+
+    def _payload(self, login, i):
+        rng = self._rng("payload", login, i)
+        commits = [{
+            "sha": "%040x" % rng.getrandbits(160),
+            "author": {"email": "%s@example.com" % login, "name": login.title()},
+            "message": "synthetic commit message number %s" % i,
+            "distinct": True,
+        } for i in range(rng.randrange(1, 4))]
+        return {"push_id": rng.getrandbits(32), "size": len(commits), "ref": "refs/heads/master",
+                "head": commits[-1]["sha"], "before": "%040x" % rng.getrandbits(160), "commits": commits}
+
+    def members(self, login):
+        rng = self._rng("members", login)
+        return [self._owner(user) for user in sorted({self._random_user(rng) for i in range(self.num_members)})]
+
+    def resolve(self, path):
+        """Returns the json object for an api path, or None for 404"""
+        p = path.strip("/").split("/")
+        if len(p) == 2 and p[0] == "users" and (self.is_user(p[1]) or self.is_org(p[1])):
+            return self.user(p[1]) if self.is_user(p[1]) else self._owner(p[1])
+        if len(p) == 2 and p[0] == "orgs" and self.is_org(p[1]):
+            return self.org(p[1])
+        if len(p) == 3 and p[0] in ("users", "orgs") and (self.is_user(p[1]) or self.is_org(p[1])):
+            if p[2] == "repos":
+                return self.repo_list(p[1])
+            if p[2] == "events":
+                return self.events(p[1])
+            if p[2] == "members" and p[0] == "orgs" and self.is_org(p[1]):
+                return self.members(p[1])
+        if len(p) >= 3 and p[0] == "repos" and (self.is_user(p[1]) or self.is_org(p[1])):
+            if len(p) == 3:
+                return self.repo(p[1], p[2])
+            if len(p) == 4 and p[3] == "contributors" and p[2] in self.repo_names(p[1]):
+                return self.contributors(p[1], p[2])
+        if p == ["user"]:
+            return self.user("user0")
+        return None
+
+
+_OWNER_URLS = (
+    ("followers", "/followers"), ("following", "/following{/other_user}"), ("gists", "/gists{/gist_id}"),
+    ("starred", "/starred{/owner}{/repo}"), ("subscriptions", "/subscriptions"),
+    ("organizations", "/orgs"), ("repos", "/repos"), ("events", "/events{/privacy}"),
+    ("received_events", "/received_events"),
+)
+
+_REPO_URLS = (
+    ("forks", "/forks"), ("keys", "/keys{/key_id}"), ("collaborators", "/collaborators{/collaborator}"),
+    ("teams", "/teams"), ("hooks", "/hooks"), ("issue_events", "/issues/events{/number}"), ("events", "/events"),
+    ("assignees", "/assignees{/user}"), ("branches", "/branches{/branch}"), ("tags", "/tags"),
+    ("blobs", "/git/blobs{/sha}"), ("git_tags", "/git/tags{/sha}"), ("git_refs", "/git/refs{/sha}"),
+    ("trees", "/git/trees{/sha}"), ("statuses", "/statuses/{sha}"), ("languages", "/languages"),
+    ("stargazers", "/stargazers"), ("contributors", "/contributors"), ("subscribers", "/subscribers"),
+    ("subscription", "/subscription"), ("commits", "/commits{/sha}"), ("git_commits", "/git/commits{/sha}"),
+    ("comments", "/comments{/number}"), ("issue_comment", "/issues/comments{/number}"),
+    ("contents", "/contents/{+path}"), ("compare", "/compare/{base}...{head}"), ("merges", "/merges"),
+    ("archive", "/{archive_format}{/ref}"), ("downloads", "/downloads"), ("issues", "/issues{/number}"),
+    ("pulls", "/pulls{/number}"), ("milestones", "/milestones{/number}"),
+    ("notifications", "/notifications{?since,all,participating}"), ("labels", "/labels{/name}"),
+    ("releases", "/releases{/id}"), ("deployments", "/deployments"),
+)
+
+
+def _id(name):
+    return zlib.crc32(name.encode("utf-8")) & 0xffffff
+
+
+class FakeGithubServer(object):
+    """
+    Serves a FakeGithubWorld on localhost in a background thread.
+
+        with FakeGithubServer() as server:
+            client = GithubClient(base_url=server.base_url)
+    """
+
+    def __init__(self, world=None, latency=0., rate_limit=10 ** 6):
+        """
+        :param latency: seconds to sleep before each response
+        :param rate_limit: requests per hour and credential reported in the headers, 403 when used up
+        """
+        self.world = world or FakeGithubWorld()
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.num_requests = 0
+        # Authorization header -> number of requests
+        self.used = dict()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self.base_url = "http://127.0.0.1:%s/" % self._server.server_address[1]
+        self.world.base_url = self.base_url
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # headers and body are separate writes, don't let them wait for the delayed ack
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.num_requests += 1
+                    auth = self.headers.get("Authorization")
+                    server.used[auth] = used = server.used.get(auth, 0) + 1
+                    remaining = max(0, server.rate_limit - used)
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                headers = {
+                    "X-RateLimit-Limit": str(server.rate_limit),
+                    "X-RateLimit-Remaining": str(remaining),
+                    "X-RateLimit-Reset": str(int(time.time()) + 3600),
+                    "X-RateLimit-Resource": "core",
+                }
+                if used > server.rate_limit:
+                    return self._send(403, {"message": "API rate limit exceeded", "documentation_url": ""}, headers)
+                data = server.world.resolve(url.path)
+                if data is None:
+                    return self._send(404, {"message": "Not Found", "documentation_url": ""}, headers)
+                if isinstance(data, list):
+                    data = self._paginate(data, url, headers)
+                body = json.dumps(data).encode("utf-8")
+                headers["ETag"] = '"%s"' % hashlib.md5(body).hexdigest()
+                if self.headers.get("If-None-Match") == headers["ETag"]:
+                    with server._lock:
+                        server.used[auth] -= 1
+                    return self._send(304, None, headers)
+                self._send(200, data, headers, body)
+
+            def _paginate(self, data, url, headers):
+                query = parse_qs(url.query)
+                per_page = min(100, int(query.get("per_page", ["30"])[0]))
+                page = int(query.get("page", ["1"])[0])
+                last = max(1, (len(data) + per_page - 1) // per_page)
+                page_url = server.base_url.rstrip("/") + url.path + "?per_page=%s&page=%%s" % per_page
+                links = []
+                if page < last:
+                    links += ['<%s>; rel="next"' % (page_url % (page + 1)), '<%s>; rel="last"' % (page_url % last)]
+                if page > 1:
+                    links += ['<%s>; rel="prev"' % (page_url % (page - 1)), '<%s>; rel="first"' % (page_url % 1)]
+                if links:
+                    headers["Link"] = ", ".join(links)
+                return data[(page - 1) * per_page:page * per_page]
+
+            def _send(self, status, data, headers, body=None):
+                if body is None:
+                    body = json.dumps(data).encode("utf-8") if data is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,211 @@
+"""
+Offline benchmarks against the local fake github api, with an sqlite cache
+in a temporary directory. Nothing is sent to github.
+
+    python -m benchmarks.run                  # all benchmarks
+    python -m benchmarks.run crawl html       # some of them
+    python -m benchmarks.run --quick          # smaller sizes
+    python -m benchmarks.run --latency 0.05   # simulate network round trips
+"""
+import argparse
+import contextlib
+import gc
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from githubapi import Github, GithubClient, GithubNodes, GithubCrawler, NodeVis, SqliteBackend
+from githubapi.schema import CacheSchema
+from benchmarks.fakegithub import FakeGithubServer, FakeGithubWorld
+
+
+class Benchmarks(object):
+
+    def __init__(self, quick=False, latency=0., num_workers=8):
+        self.quick = quick
+        self.latency = latency
+        self.num_workers = num_workers
+        self.tmp_dir = tempfile.mkdtemp(prefix="githubapi-bench-")
+        self.server = FakeGithubServer(FakeGithubWorld(), latency=latency).start()
+
+    def close(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def github(self, name, use_network=True, **kwargs):
+        """Github with an sqlite cache file per name and a client for the fake server"""
+        client = GithubClient(auth=("bench", "bench"), num_workers=self.num_workers, base_url=self.server.base_url)
+        backend = SqliteBackend(os.path.join(self.tmp_dir, "%s.sqlite" % name))
+        return Github(net_client=client, cache_backend=backend, use_network=use_network, **kwargs)
+
+    @staticmethod
+    def _quiet(func, *args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args)
+
+    def bench_crawl(self):
+        """Builds graphs with GithubNodes and GithubCrawler, first from network then from cache"""
+        print("\ncrawl throughput" + (", %.0fms latency" % (self.latency * 1000) if self.latency else ""))
+        print("%-30s %8s %8s %9s %8s %10s %10s" % (
+            "", "nodes", "edges", "requests", "seconds", "nodes/s", "requests/s"))
+        depths = (1, 2) if self.quick else (1, 2, 3)
+        for depth in depths:
+            for name, crawl in (
+                    ("GithubNodes", lambda nodes: nodes.add_user("user0", depth)),
+                    ("GithubCrawler", lambda nodes: GithubCrawler(nodes).crawl("u:user0", depth)),
+            ):
+                cache_name = "crawl-%s-%s" % (name, depth)
+                for run, use_network in (("network", True), ("cache", False)):
+                    git = self.github(cache_name, use_network=use_network)
+                    nodes = GithubNodes(git)
+                    start = time.time()
+                    crawl(nodes)
+                    seconds = time.time() - start
+                    print("%-30s %8s %8s %9s %8.2f %10.0f %10.0f" % (
+                        "%s depth %s %s" % (name, depth, run),
+                        len(nodes.nodes), len(nodes.edges), git.num_requests, seconds,
+                        len(nodes.nodes) / seconds, git.num_requests / seconds,
+                    ))
+
+    def bench_cache(self):
+        """Lookup latency of cached users through the memory cache, the sqlite backend and in batches"""
+        num = 2000 if self.quick else 20000
+        logins = ["user%s" % i for i in range(num)]
+        git = self.github("cache", use_network=False, memory_cache_size=num)
+        git.put_cached("user", [({"login": login}, {"login": login, "id": i}) for i, login in enumerate(logins)])
+        print("\ncache lookup latency, %s users" % num)
+        for name, github, lookup in (
+                ("backend get_user", self.github("cache", use_network=False, memory_cache_size=0),
+                 lambda git: [git.get_user(login) for login in logins]),
+                ("backend get_users", self.github("cache", use_network=False, memory_cache_size=0),
+                 lambda git: git.get_users(logins)),
+                ("memory get_user", git, lambda git: [git.get_user(login) for login in logins]),
+        ):
+            start = time.time()
+            found = lookup(github)
+            seconds = time.time() - start
+            assert all(found)
+            print("%-30s %8.1f us/lookup" % (name, seconds / num * 1e6))
+
+    def bench_schema(self):
+        """Cache size and cached crawl time with whole documents, the default schema and without blobs"""
+        depth = 2 if self.quick else 3
+        print("\ncache schema, crawl depth %s" % depth)
+        print("%-30s %10s %10s %10s %10s" % ("", "plain kb", "blob kb", "seconds", "peak mb"))
+        for name, schema in (
+                ("whole documents", CacheSchema(fields=None)),
+                ("CacheSchema()", CacheSchema()),
+                ("CacheSchema(blob=False)", CacheSchema(blob=False)),
+        ):
+            cache_name = "schema-%s" % name.replace(" ", "-")
+            GithubCrawler(GithubNodes(self.github(cache_name, cache_schema=schema))).crawl("u:user0", depth)
+            db = sqlite3.connect(os.path.join(self.tmp_dir, "%s.sqlite" % cache_name))
+            plain = blob = 0
+            for (table, ) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                sizes = db.execute('SELECT SUM(LENGTH(doc)), SUM(LENGTH(blob)) FROM "%s"' % table).fetchone()
+                plain += sizes[0] or 0
+                blob += sizes[1] or 0
+            db.close()
+
+            def _crawl():
+                git = self.github(cache_name, use_network=False, memory_cache_size=0, cache_schema=schema)
+                return GithubCrawler(GithubNodes(git)).crawl("u:user0", depth)
+            gc.collect()
+            start = time.time()
+            _crawl()
+            seconds = time.time() - start
+            gc.collect()
+            tracemalloc.start()
+            nodes = _crawl()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del nodes
+            print("%-30s %10.0f %10.0f %10.2f %10.1f" % (name, plain / 1024., blob / 1024., seconds, peak / 2. ** 20))
+
+    def bench_html(self):
+        """NodeVis.get_html and write_html time and peak memory for synthetic graphs"""
+        sizes = (1000, 10000) if self.quick else (1000, 10000, 100000)
+        print("\nNodeVis html")
+        print("%-30s %8s %8s %10s %10s" % ("", "nodes", "edges", "seconds", "peak mb"))
+        for size in sizes:
+            nodes = synthetic_graph(size)
+            for name, func in (
+                    ("get_html", lambda vis: vis.get_html()),
+                    ("write_html", lambda vis: self._quiet(vis.write_html, os.path.join(self.tmp_dir, "bench.html"))),
+            ):
+                gc.collect()
+                start = time.time()
+                func(NodeVis(nodes))
+                seconds = time.time() - start
+                # tracemalloc slows down allocations, so the memory is measured in a second run
+                gc.collect()
+                tracemalloc.start()
+                func(NodeVis(nodes))
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print("%-30s %8s %8s %10.2f %10.1f" % (
+                    name, len(nodes.nodes), len(nodes.edges), seconds, peak / 2. ** 20))
+
+
+def synthetic_graph(num_nodes, edges_per_node=3, seed=23):
+    """Returns a GithubNodes graph of users and repos without github access"""
+    import random
+    rng = random.Random(seed)
+    node_ids = []
+    state_nodes = []
+    for i in range(num_nodes):
+        if i % 3:
+            login = "user%s" % i
+            obj = {"login": login, "name": login.title(), "avatar_url": "https://avatars.example.com/%s" % login,
+                   "followers": rng.randrange(500), "location": "Berlin"}
+            node_ids.append("u:" + login)
+        else:
+            obj = {"full_name": "user%s/repo%s" % (i + 1, i), "name": "repo%s" % i,
+                   "stargazers_count": rng.randrange(1000), "description": "synthetic repository"}
+            node_ids.append("r:" + obj["full_name"])
+        state_nodes.append((node_ids[-1], obj))
+    repos = [node_id for node_id in node_ids if node_id.startswith("r:")]
+    users = [node_id for node_id in node_ids if node_id.startswith("u:")]
+    edges = dict()
+    for user in users:
+        for i in range(edges_per_node):
+            edges[(user, rng.choice(repos))] = (rng.choice(["owns", "contributes", "pushed"]), rng.random())
+    nodes = GithubNodes(github_api=object())
+    nodes.set_state({
+        "nodes": state_nodes,
+        "edges": [(key[0], key[1], [edge_type], strength) for key, (edge_type, strength) in edges.items()],
+    })
+    return nodes
+
+
+BENCHMARKS = ("crawl", "cache", "schema", "html")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", help="any of %s" % ", ".join(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="smaller graphs and crawls")
+    parser.add_argument("--latency", type=float, default=0., help="seconds per fake api response")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent requests of the client")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %r" % name)
+
+    bench = Benchmarks(quick=args.quick, latency=args.latency, num_workers=args.workers)
+    try:
+        for name in args.benchmarks or BENCHMARKS:
+            getattr(bench, "bench_%s" % name)()
+    finally:
+        bench.close()
+
+
+if __name__ == "__main__":
+    main()
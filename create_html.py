@@ -1,11 +1,21 @@
+import logging
 import os
 
 from githubapi import Github, GithubNodes, NodeVis
 
+SNAPSHOT = "./github-nodes.snapshot"
+
+logging.basicConfig(level=logging.INFO)
+
 git = Github(use_cache=True, use_network=True)
 nodes = GithubNodes(git)
 
-nodes.add_repo("defgsus/github-nodes", 2)
+# delete the snapshot to rebuild the graph from the cache
+if os.path.exists(SNAPSHOT):
+    nodes.load(SNAPSHOT)
+else:
+    nodes.add_repo("defgsus/github-nodes", 2)
+    nodes.save(SNAPSHOT)
 
 vis = NodeVis(nodes)
 vis.write_html("./index.html")
@@ -1,5 +1,11 @@
 from .client import GithubClient
+from .ratelimit import RateLimiter
+from .cassette import Cassette
+from .backends import CacheBackend, MongoBackend, SqliteBackend
 from .api import Github
 from .nodes import GithubNodes
+from .crawler import GithubCrawler
+from .jobqueue import JobQueue, SqliteJobQueue, MongoJobQueue
+from .distributed import CrawlWorker, CrawlCoordinator
 from .nodevis import NodeVis
 from .stats import *
\ No newline at end of file
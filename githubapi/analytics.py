@@ -0,0 +1,194 @@
+"""
+Graph analytics on GithubNodes with a sparse adjacency matrix in numpy.
+
+analyze() runs everything and writes the results to Node.attrs.
+"""
+import numpy as np
+
+
+class GraphMatrix(object):
+    """
+    Sparse adjacency matrix of a GithubNodes graph in CSR format.
+
+    The weight of an edge is its strength times the largest weight of its types
+    in `type_weights` (1 for types not listed).
+    If not `directed`, each edge is stored in both directions.
+    """
+
+    def __init__(self, nodes, type_weights=None, directed=False):
+        type_weights = type_weights or dict()
+        self.directed = directed
+        self.node_ids = list(nodes.nodes)
+        self.index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.num_nodes = len(self.node_ids)
+
+        num_edges = len(nodes.edges)
+        rows = np.empty(num_edges, dtype=np.int64)
+        cols = np.empty(num_edges, dtype=np.int64)
+        data = np.empty(num_edges, dtype=np.float64)
+        for i, ((from_id, to_id), edge) in enumerate(nodes.edges.items()):
+            rows[i] = self.index[from_id]
+            cols[i] = self.index[to_id]
+            data[i] = edge.strength * max(type_weights.get(t, 1.) for t in edge.types)
+        if not directed:
+            rows, cols, data = np.concatenate([rows, cols]), np.concatenate([cols, rows]), np.concatenate([data, data])
+
+        order = np.lexsort((cols, rows))
+        self.indices = cols[order]
+        self.data = data[order]
+        self.indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.num_nodes), out=self.indptr[1:])
+        # row index of each entry, for the vectorized products
+        self.rows = rows[order]
+
+    def dot(self, x):
+        """Returns A @ x"""
+        return np.bincount(self.rows, self.data * x[self.indices], self.num_nodes)
+
+    def dot_transposed(self, x):
+        """Returns A.T @ x"""
+        return np.bincount(self.indices, self.data * x[self.rows], self.num_nodes)
+
+    def dot_symmetric(self, x):
+        """Returns (A + A.T) @ x for a directed matrix, A @ x otherwise"""
+        if self.directed:
+            return self.dot(x) + self.dot_transposed(x)
+        return self.dot(x)
+
+    def out_weights(self):
+        return np.bincount(self.rows, self.data, self.num_nodes)
+
+    def to_dict(self, values):
+        """Returns a dict of node id -> value"""
+        return dict(zip(self.node_ids, values.tolist()))
+
+
+def pagerank(matrix, damping=.85, tol=1e-8, max_iterations=100):
+    """Weighted PageRank, rank flows along the edge direction"""
+    n = matrix.num_nodes
+    if not n:
+        return np.zeros(0)
+    out = matrix.out_weights()
+    dangling = out == 0
+    inv_out = np.divide(1., out, out=np.zeros(n), where=~dangling)
+    rank = np.full(n, 1. / n)
+    for i in range(max_iterations):
+        new_rank = damping * matrix.dot_transposed(rank * inv_out)
+        new_rank += (1. - damping + damping * rank[dangling].sum()) / n
+        delta = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if delta < tol:
+            break
+    return rank
+
+
+def degree_centrality(matrix):
+    """Sum of the edge weights of each node in both directions, divided by the maximum"""
+    degree = matrix.dot_symmetric(np.ones(matrix.num_nodes))
+    top = degree.max() if len(degree) else 0.
+    return degree / top if top else degree
+
+
+def eigenvector_centrality(matrix, tol=1e-8, max_iterations=200):
+    """Power iteration on the symmetric matrix, normalized to a maximum of 1"""
+    n = matrix.num_nodes
+    x = np.full(n, 1.)
+    for i in range(max_iterations):
+        # the shift by x keeps the iteration from oscillating on bipartite graphs (users - repos)
+        new_x = matrix.dot_symmetric(x) + x
+        top = new_x.max() if n else 0.
+        if not top:
+            return new_x
+        new_x /= top
+        delta = np.abs(new_x - x).max()
+        x = new_x
+        if delta < tol:
+            break
+    return x
+
+
+def connected_components(matrix):
+    """Returns the component number of each node, ignoring the edge direction.
+    Component 0 is the largest"""
+    n = matrix.num_nodes
+    labels = np.arange(n)
+    while True:
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, matrix.rows, labels[matrix.indices])
+        np.minimum.at(new_labels, matrix.indices, labels[matrix.rows])
+        # pointer jumping to the label's label
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return _number_by_size(labels)
+
+
+def label_propagation(matrix, max_iterations=30, seed=23):
+    """
+    Communities by weighted label propagation, ignoring the edge direction.
+    Each step a random half of the nodes takes the label with the largest
+    edge weight among its neighbours.
+    Community 0 is the largest.
+    """
+    n = matrix.num_nodes
+    rng = np.random.default_rng(seed)
+    labels = np.arange(n)
+    if not n:
+        return labels
+    # each node votes for its own label with a tiny weight, so every node has a candidate
+    voter = np.concatenate([matrix.rows, matrix.indices, np.arange(n)])
+    target = np.concatenate([matrix.indices, matrix.rows, np.arange(n)])
+    weights = np.concatenate([matrix.data, matrix.data, np.full(n, 1e-9)])
+    for i in range(max_iterations):
+        # sum the weights per (node, label) pair
+        key = target * n + labels[voter]
+        order = np.argsort(key)
+        key = key[order]
+        starts = np.flatnonzero(np.concatenate([[True], key[1:] != key[:-1]]))
+        candidates = key[starts]
+        score = np.add.reduceat(weights[order], starts) + rng.random(len(starts)) * 1e-12
+        # the best candidate per node, candidates are sorted by node
+        node = candidates // n
+        node_starts = np.flatnonzero(np.concatenate([[True], node[1:] != node[:-1]]))
+        best_score = np.maximum.reduceat(score, node_starts)
+        is_best = score == np.repeat(best_score, np.diff(np.append(node_starts, len(node))))
+        best = np.empty(n, dtype=np.int64)
+        best[node[is_best]] = candidates[is_best] % n
+
+        update = rng.random(n) < .5
+        changed = (best[update] != labels[update]).sum()
+        labels[update] = best[update]
+        if changed <= n * 1e-4:
+            break
+    return _number_by_size(labels)
+
+
+def _number_by_size(labels):
+    """Renumbers the labels 0, 1, .. from the most frequent to the least"""
+    if not len(labels):
+        return labels
+    unique, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    rank = np.empty(len(unique), dtype=np.int64)
+    rank[np.argsort(-counts, kind="stable")] = np.arange(len(unique))
+    return rank[inverse]
+
+
+def analyze(nodes, type_weights=None, directed=False):
+    """
+    Computes pagerank, degree and eigenvector centrality, connected components and
+    label propagation communities and writes them to the `attrs` of each node.
+    :return: the GraphMatrix
+    """
+    matrix = GraphMatrix(nodes, type_weights=type_weights, directed=directed)
+    results = {
+        "pagerank": pagerank(matrix),
+        "degree_centrality": degree_centrality(matrix),
+        "eigenvector_centrality": eigenvector_centrality(matrix),
+        "component": connected_components(matrix),
+        "community": label_propagation(matrix),
+    }
+    for name, values in results.items():
+        for node_id, value in zip(matrix.node_ids, values.tolist()):
+            nodes.nodes[node_id].attrs[name] = value
+    return matrix
@@ -1,12 +1,20 @@
-import pymongo
+import logging
+import threading
+import time
 
 from .client import GithubClient
+from .cache import LRUCache
+from .backends import MongoBackend
+from .schema import CacheSchema
+from .metrics import Metrics
+
+log = logging.getLogger(__name__)
 
 
 class Github(object):
     """
     Returns raw json objects from github v3
-    Uses mongo-db for caching.
+    Uses a CacheBackend for caching, by default mongo-db:
     /github/cache/
         user/{"login"}                      : user object identified by "login"
         org/{"login"}                       : organisation object
@@ -15,28 +23,67 @@ class Github(object):
         events/{"login"}                    : list of events per user/org
         members/{"login"}                   : list of members per org
         contributors/{"login", "name"}      : list of contributors per user/org and short repo name
+
+    Each document also stores `_cached_at` and the `_etag`/`_last_modified` of the response.
+    `cache_ttl` maps table names to seconds, e.g. {"events": 600, "user": 86400}.
+    Older entries of these tables are revalidated with a conditional request,
+    tables not in `cache_ttl` never expire.
+
+    Documents are stored and read with the fields of `cache_schema` only,
+    the other fields are kept compressed, see get_full_document().
+    Up to `memory_cache_size` recently used documents are also held in memory.
+
+    Requests, cache lookups and rate-limit waits are counted in `metrics`,
+    which is shared with the network client.
     """
-    def __init__(self, use_cache=True, use_network=True):
-        self._db_client = pymongo.MongoClient()
-        self._cache = self._db_client["github"]["cache"]
+    def __init__(self, use_cache=True, use_network=True, net_client=None, cache_ttl=None,
+                 memory_cache_size=10000, cache_backend=None, metrics=None, cache_schema=None):
+        """
+        :param cache_backend: a CacheBackend instance, defaults to MongoBackend(),
+            use SqliteBackend(filename) for an embedded cache
+        :param metrics: a Metrics instance, defaults to the one of net_client or a new one
+        :param cache_schema: a CacheSchema instance, defaults to CacheSchema(),
+            use CacheSchema(fields=None) to store and read whole documents
+        """
+        self._cache = cache_backend or MongoBackend()
+        self.cache_schema = cache_schema or CacheSchema()
+        self._memory_cache = LRUCache(memory_cache_size)
         self.use_cache = use_cache
         self.use_network = use_network
-        self._net_client = None
+        self.cache_ttl = dict(cache_ttl or {})
+        # page size for list requests, 100 is githubs maximum
+        self.per_page = 100
+        self._net_client = net_client
+        self.metrics = metrics or (net_client.metrics if net_client is not None else Metrics())
+        self._net_client_lock = threading.Lock()
         self._ignore_cach = set()
 
-    def __del__(self):
-        del self._cache
-        del self._db_client
-
     def clear_cache(self, table, db_query=None):
         """
         removes the cache for the given entry. 
         e.g.: clear_cache("user", {"login": "Johannes"})
         """
-        if db_query is not None:
-            self._cache[table].delete_many(db_query)
-        else:
-            self._cache[table].drop()
+        self._cache.delete(table, db_query)
+        self._memory_cache.invalidate(table, db_query)
+
+    @property
+    def cache_backend(self):
+        """The CacheBackend the documents are stored in"""
+        return self._cache
+
+    @property
+    def num_requests(self):
+        """Number of network requests sent so far"""
+        return self._net_client.num_requests if self._net_client is not None else 0
+
+    def run_concurrently(self, func, items):
+        """Calls func(item) for every item in the network client's thread pool,
+        returns the results in the order of items"""
+        return self._client().map(func, items)
+
+    def cache_stats(self):
+        """Returns hit/miss statistics of the in-memory cache"""
+        return self._memory_cache.stats()
 
     def is_user(self, login_name):
         """Returns true if `login_name` is the login of a regular git user"""
@@ -59,6 +106,13 @@ class Github(object):
             "user", {"login": login_name}
         )
 
+    def get_users(self, login_names):
+        """Returns a list of user json objects (or None) per login, fetched concurrently"""
+        return self._get_cached_urls(
+            ["users/%s" % login_name for login_name in login_names],
+            "user", [{"login": login_name} for login_name in login_names]
+        )
+
     def get_organisation(self, login_name):
         """
         Returns the organisation json object, or None.
@@ -70,23 +124,79 @@ class Github(object):
             "org", {"login": login_name}
         )
 
+    def get_organisations(self, login_names):
+        """Returns a list of organisation json objects (or None) per login, fetched concurrently"""
+        return self._get_cached_urls(
+            ["orgs/%s" % login_name for login_name in login_names],
+            "org", [{"login": login_name} for login_name in login_names]
+        )
+
     def get_events(self, login_name):
         """
         Returns a list of events for the organisation or user, or None
         """
-        def _transform(event):
-            if "actor" in event:
-                del event["actor"]  # remove the redundant user entry
-            if "org" in event:
-                del event["org"]
-            return event
         return self._get_cached_list_url(
-            "%s/%s/events" % (
-                "orgs" if self.is_organisation(login_name) else "users", login_name),
+            self._events_url(login_name),
             "events", {"login": login_name},
-            transform=_transform
+            transform=self._transform_event
         )
 
+    def sync_events(self, login_name):
+        """
+        Polls the events of the organisation or user and adds the new ones to the cached list.
+        The request is conditional on the etag of the cached list and pages are
+        only requested up to the newest cached event, so an unchanged list costs
+        one request that does not count against the rate limit.
+        :return: list of the new events, newest first, or None on error
+        """
+        query = {"login": login_name}
+        cached = self.get_full_document("events", query)
+        cached_events = (cached.get("list") or []) if cached is not None else []
+        known_ids = {event.get("id") for event in cached_events}
+        headers = None
+        if cached is not None and cached.get("_etag"):
+            headers = {"If-None-Match": cached["_etag"]}
+        client = self._client()
+        pages = client.iter_pages(self._events_url(login_name), {"per_page": self.per_page}, headers)
+        new_events = []
+        response_headers = None
+        try:
+            for page in pages:
+                if response_headers is None:
+                    if GithubClient.is_not_modified(page):
+                        break
+                    response_headers = client.headers or {}
+                if not isinstance(page, list):
+                    log.warning("can not sync events of %s: %s", login_name, page.get("message"))
+                    return None
+                seen_known = False
+                for event in page:
+                    if event.get("id") in known_ids:
+                        seen_known = True
+                        break
+                    new_events.append(self._transform_event(event))
+                if seen_known:
+                    break
+        finally:
+            pages.close()
+
+        if response_headers is None:
+            # not modified, the cached document holds the full document
+            self._touch_cache("events", query, None, client.headers or {})
+            log.debug("sync-events: no new events of %s", login_name)
+            return new_events
+        data = dict(cached or query)
+        data.pop("ERROR", None)
+        data.update({
+            "list": new_events + cached_events,
+            "_etag": response_headers.get("ETag"),
+            "_last_modified": response_headers.get("Last-Modified"),
+            "_cached_at": time.time(),
+        })
+        self._store_cache("events", data, query)
+        log.debug("sync-events: %s new events of %s", len(new_events), login_name)
+        return new_events
+
     def get_organisation_members(self, login_name):
         """
         Returns a list of user objects, or None
@@ -104,25 +214,29 @@ class Github(object):
     def get_repos(self, login_name):
         repolist = self.get_repo_list(login_name)
         if repolist is not None:
-            repos = []
-            for repoitem in repolist:
-                repo = self.get_repo(repoitem["full_name"])
-                if repo is not None:
-                    repos.append(repo)
-            return repos
+            repos = self.get_repos_by_name([repoitem["full_name"] for repoitem in repolist])
+            return [repo for repo in repos if repo is not None]
         return None
 
     def get_repo_list(self, login_name):
         """
         Returns a list of repository identifier objects for a user or organisation, or None
         The returned objects will contain the fields `login`, `name`, `fullname`, `fork`
+        The full repository objects of a fetched list also seed the `repo` cache.
         """
-        return self._get_cached_list_url(
+        def _transform(repo):
+            full_repos.append(repo)
+            return self._get_repo_info(repo)
+        full_repos = []
+        repos = self._get_cached_list_url(
             "%s/%s/repos" % (
                 "orgs" if self.is_organisation(login_name) else "users", login_name),
             "repos", {"login": login_name},
-            transform=self._get_repo_info
+            transform=_transform
         )
+        if full_repos:
+            self._seed_repo_cache(full_repos)
+        return repos
 
     def get_repo(self, login_or_full_name, name=None):
         """
@@ -131,11 +245,6 @@ class Github(object):
         :param name: either "reponame" or None
         :return: A repository json object, or None
         """
-        def _transform(r):
-            for key in ("source", "parent"):
-                if key in r:
-                    r[key] = self._get_repo_info(r[key])
-            return r
         if name is None:
             assert "/" in login_or_full_name
             login_name, name = login_or_full_name.split("/")
@@ -144,7 +253,19 @@ class Github(object):
         return self._get_cached_url(
             "repos/%s/%s" % (login_name, name),
             "repo", {"login": login_name, "name": name},
-            transform=_transform
+            transform=self._transform_repo
+        )
+
+    def get_repos_by_name(self, full_names):
+        """
+        Returns a list of repository objects (or None) per full name, fetched concurrently
+        :param full_names: list of "owner/reponame" strings
+        """
+        names = [full_name.split("/") for full_name in full_names]
+        return self._get_cached_urls(
+            ["repos/%s/%s" % (login_name, name) for login_name, name in names],
+            "repo", [{"login": login_name, "name": name} for login_name, name in names],
+            transform=self._transform_repo
         )
 
     def get_repo_contributors(self, repo_or_full_name):
@@ -167,19 +288,121 @@ class Github(object):
             lambda r: {key: r[key] for key in ("login", "id", "contributions")},
         )
 
+    def get_full_document(self, table, query):
+        """
+        Returns the cached document with all fields of the github object, or None.
+        e.g.: get_full_document("repo", {"login": "defgsus", "name": "github-nodes"})["license"]
+        """
+        with self.metrics.timer("cache_read_seconds", table):
+            data = self._cache.find_one(table, query)
+        return self.cache_schema.unpack(table, data) if data is not None else None
+
+    def get_cached(self, table, query):
+        """
+        Returns the cached document with the plain fields of the cache schema, or None.
+        Never requests the network.
+        e.g.: get_cached("user", {"login": "defgsus"})
+        """
+        return self._get_cache(table, query)
+
+    def is_cached(self, table, query):
+        """
+        True if a document is cached, without reading it from the backend.
+        e.g.: is_cached("events", {"login": "defgsus"})
+        """
+        if self._memory_cache.contains(table, query):
+            return True
+        with self.metrics.timer("cache_read_seconds", table):
+            return self._cache.exists(table, query)
+
+    def put_cached(self, table, items):
+        """
+        Stores a list of (query, github object) tuples in the cache, e.g. to seed it from a dump.
+        The query fields are added to the stored documents like for fetched objects,
+        objects without `_cached_at` are stamped with the current time.
+        e.g.: put_cached("user", [({"login": "defgsus"}, user)])
+        """
+        now = time.time()
+        self._store_cache_many(table, [
+            (query, {"_cached_at": now, **obj, **query}) for query, obj in items
+        ])
+
     def get_url(self, api_path, params=None):
         ret = self._get_url(api_path, params)
         if isinstance(ret, dict) and list(ret.keys()) == ["list"]:
             return ret["list"]
         return ret
 
+    def _pack(self, table, obj):
+        """Returns the slim document and the document to store"""
+        slim, blob = self.cache_schema.pack(table, obj)
+        return slim, dict(slim, _blob=blob) if blob is not None else slim
+
     def _store_cache(self, table, obj, replace_filter=None):
+        """Stores the object and returns the slim document"""
+        self.metrics.inc("cache_stores", label=table)
+        obj, doc = self._pack(table, obj)
         if replace_filter is not None:
-            if self._cache[table].replace_one(replace_filter, obj).matched_count > 0:
-                print("replace-cache: %s %s" % (table, replace_filter))
-                return
-        print("store-cache: %s %s" % (table, replace_filter))
-        self._cache[table].insert_one(obj)
+            self._memory_cache.put(table, replace_filter, obj)
+            with self.metrics.timer("cache_write_seconds", table):
+                replaced = self._cache.replace(table, replace_filter, doc)
+            log.debug("%s-cache: %s %s", "replace" if replaced else "store", table, replace_filter)
+            return obj
+        log.debug("store-cache: %s %s", table, replace_filter)
+        with self.metrics.timer("cache_write_seconds", table):
+            self._cache.insert(table, doc)
+        return obj
+
+    def _seed_repo_cache(self, repos):
+        """
+        Stores the repository objects of a list response in the `repo` table,
+        unless already cached. Forks are left out because only the single
+        repository request returns their `source` and `parent`.
+        """
+        repos = [repo for repo in repos if not repo.get("fork") and repo.get("owner")]
+        queries = [{"login": repo["owner"]["login"], "name": repo["name"]} for repo in repos]
+        cached = self._get_cache_many("repo", queries)
+        now = time.time()
+        items = []
+        for repo, query, data in zip(repos, queries, cached):
+            if data is None:
+                repo = self._transform_repo(dict(repo))
+                repo.update(query)
+                repo.update({"_etag": None, "_last_modified": None, "_cached_at": now})
+                items.append((query, repo))
+        self._store_cache_many("repo", items)
+
+    def _store_cache_many(self, table, items):
+        """Stores a list of (replace_filter, obj) tuples in one batch"""
+        if not items:
+            return
+        docs = []
+        for replace_filter, obj in items:
+            obj, doc = self._pack(table, obj)
+            self._memory_cache.put(table, replace_filter, obj)
+            docs.append((replace_filter, doc))
+        log.debug("store-cache: %s %s objects", table, len(items))
+        self.metrics.inc("cache_stores", len(items), table)
+        with self.metrics.timer("cache_write_seconds", table):
+            self._cache.put_many(table, docs)
+
+    def _events_url(self, login_name):
+        return "%s/%s/events" % ("orgs" if self.is_organisation(login_name) else "users", login_name)
+
+    @staticmethod
+    def _transform_event(event):
+        if "actor" in event:
+            del event["actor"]  # remove the redundant user entry
+        if "org" in event:
+            del event["org"]
+        return event
+
+    @classmethod
+    def _transform_repo(cls, repo):
+        for key in ("source", "parent"):
+            if key in repo:
+                repo[key] = cls._get_repo_info(repo[key])
+        return repo
 
     @staticmethod
     def _get_repo_info(repo):
@@ -193,39 +416,138 @@ class Github(object):
         }
 
     def _get_cache(self, table, query):
-        data = self._cache[table].find_one(query)
+        data = self._memory_cache.get(table, query)
+        if data is not None:
+            self.metrics.inc("cache_memory_hits", label=table)
+            return data
+        with self.metrics.timer("cache_read_seconds", table):
+            data = self._cache.find_one(table, query, self.cache_schema.projection(table))
         if data is None:
-            pass  # print("cache-not-found: %s %s" % (table, query))
+            self.metrics.inc("cache_misses", label=table)
         else:
-            print("read-cache: %s %s" % (table, query))
+            log.debug("read-cache: %s %s", table, query)
+            self.metrics.inc("cache_backend_hits", label=table)
+            self._memory_cache.put(table, query, data)
         return data
 
-    def _get_url(self, url, params=None, transform=None):
-        if self._net_client is None:
-            self._net_client = GithubClient()
-        data = self._net_client.get(url, params)
+    def _get_cache_many(self, table, queries):
+        """Like _get_cache for a list of queries, the memory misses are read in one batch"""
+        datas = [self._memory_cache.get(table, query) for query in queries]
+        missing = [i for i, data in enumerate(datas) if data is None]
+        self.metrics.inc("cache_memory_hits", len(queries) - len(missing), table)
+        if missing:
+            with self.metrics.timer("cache_read_seconds", table):
+                found = self._cache.find_many(
+                    table, [queries[i] for i in missing], self.cache_schema.projection(table))
+            for i, data in zip(missing, found):
+                if data is not None:
+                    log.debug("read-cache: %s %s", table, queries[i])
+                    self._memory_cache.put(table, queries[i], data)
+                    datas[i] = data
+            num_found = sum(1 for data in found if data is not None)
+            self.metrics.inc("cache_backend_hits", num_found, table)
+            self.metrics.inc("cache_misses", len(missing) - num_found, table)
+        return datas
+
+    def _client(self):
+        with self._net_client_lock:
+            if self._net_client is None:
+                self._net_client = GithubClient(metrics=self.metrics)
+        return self._net_client
+
+    def _get_url(self, url, params=None, transform=None, headers=None):
+        """Returns the transformed json object, or None if a conditional request was not modified"""
+        data = self._client().get(url, params, headers)
+        if GithubClient.is_not_modified(data):
+            return None
         if isinstance(data, list):
             if transform is not None:
                 data = [transform(y) for y in data]
             return {"list": data}
+        if GithubClient.is_incomplete(data):
+            # not cached, see _fetch_url
+            return {"ERROR": data["message"], "_incomplete": True}
         if GithubClient.is_error(data):
             return {"ERROR": data["message"]}
         return transform(data) if transform is not None else data
 
-    def _get_cached_url(self, url, table, db_query, transform=None):
+    def _get_cached_url(self, url, table, db_query, transform=None, params=None):
         if not self.use_cache and not self.use_network:
             return None
         use_cache = self.use_cache
         data = self._get_cache(table, db_query) if use_cache else None
-        if data is None and self.use_network:
-            data = self._get_url(url, transform=transform)
-            data.update(db_query)
-            self._store_cache(table, data, db_query)
+        if (data is None or self._is_stale(table, data)) and self.use_network:
+            data = self._fetch_url(url, table, db_query, transform, cached=data, params=params)
         if data and "ERROR" in data:
             return None
         return data
 
+    def _get_cached_urls(self, urls, table, db_queries, transform=None):
+        """Like _get_cached_url for many urls, the network misses are fetched concurrently"""
+        if not self.use_cache and not self.use_network:
+            return [None] * len(urls)
+        datas = self._get_cache_many(table, db_queries) if self.use_cache else [None] * len(urls)
+        missing = [i for i, data in enumerate(datas) if data is None or self._is_stale(table, data)]
+        if missing and self.use_network:
+            fetched = self._client().map(
+                lambda i: self._fetch_url(urls[i], table, db_queries[i], transform, cached=datas[i]),
+                missing
+            )
+            for i, data in zip(missing, fetched):
+                datas[i] = data
+        return [None if data and "ERROR" in data else data for data in datas]
+
+    def _fetch_url(self, url, table, db_query, transform=None, cached=None, params=None):
+        """
+        Requests the url and stores the result in the cache.
+        If a `cached` document is given, the request is conditional on its
+        etag or modification date and an unchanged cached document is only re-stamped.
+        """
+        headers = dict()
+        if cached is not None:
+            if cached.get("_etag"):
+                headers["If-None-Match"] = cached["_etag"]
+            if cached.get("_last_modified"):
+                headers["If-Modified-Since"] = cached["_last_modified"]
+        data = self._get_url(url, params=params, transform=transform, headers=headers or None)
+        if data is not None and data.get("_incomplete"):
+            # a page of the list failed, keep the cached document and request it again next time
+            return cached if cached is not None else data
+        response_headers = self._client().headers or {}
+        if data is None:
+            return self._touch_cache(table, db_query, cached, response_headers)
+        data.update(db_query)
+        data["_etag"] = response_headers.get("ETag")
+        data["_last_modified"] = response_headers.get("Last-Modified")
+        data["_cached_at"] = time.time()
+        return self._store_cache(table, data, db_query)
+
+    def _touch_cache(self, table, query, cached, response_headers):
+        """
+        Re-stamps an unchanged cached document in place, without rewriting it.
+        Returns the updated slim document, or None without the `cached` slim document
+        """
+        fields = {"_cached_at": time.time()}
+        for field, header in (("_etag", "ETag"), ("_last_modified", "Last-Modified")):
+            if response_headers.get(header):
+                fields[field] = response_headers[header]
+        with self.metrics.timer("cache_write_seconds", table):
+            self._cache.update(table, query, fields)
+        log.debug("touch-cache: %s %s", table, query)
+        if cached is None:
+            self._memory_cache.invalidate(table, query)
+            return None
+        data = dict(cached, **fields)
+        self._memory_cache.put(table, query, data)
+        return data
+
+    def _is_stale(self, table, data):
+        ttl = self.cache_ttl.get(table)
+        if ttl is None:
+            return False
+        return time.time() - data.get("_cached_at", 0) > ttl
+
     def _get_cached_list_url(self, url, table, db_query, transform=None):
-        data = self._get_cached_url(url, table, db_query, transform)
+        data = self._get_cached_url(url, table, db_query, transform, params={"per_page": self.per_page})
         return data["list"] if data and "list" in data is not None else None
 
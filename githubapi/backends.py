@@ -0,0 +1,369 @@
+import json
+import logging
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+
+# key fields of the documents in each cache table
+TABLE_KEYS = {
+    "user": ("login",),
+    "org": ("login",),
+    "repo": ("login", "name"),
+    "repos": ("login",),
+    "events": ("login",),
+    "members": ("login",),
+    "contributors": ("login", "name"),
+}
+
+# field holding the compressed rarely used fields of a document, see schema.CacheSchema
+BLOB_FIELD = "_blob"
+
+
+def field_tree(names):
+    """("a", "b.c") -> {"a": None, "b": {"c": None}}"""
+    tree = dict()
+    for name in names:
+        node = tree
+        parts = name.split(".")
+        for part in parts[:-1]:
+            if node.get(part, False) is None:
+                break
+            node = node.setdefault(part, dict())
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def project(doc, fields):
+    """
+    Returns a copy of the document with the (dotted) fields only, like a mongo projection.
+    Lists of sub-documents are projected per item.
+    """
+    return _project(doc, field_tree(fields))
+
+
+def _project(doc, tree):
+    ret = dict()
+    for key, sub_tree in tree.items():
+        if key not in doc:
+            continue
+        value = doc[key]
+        if sub_tree is not None and isinstance(value, dict):
+            value = _project(value, sub_tree)
+        elif sub_tree is not None and isinstance(value, list):
+            value = [_project(item, sub_tree) if isinstance(item, dict) else item for item in value]
+        ret[key] = value
+    return ret
+
+
+class CacheBackend(object):
+    """
+    Document store behind the `Github` cache.
+    Documents are dicts, stored per table and found by a query dict like {"login": "name"}.
+    A `projection` is a list of (dotted) field names to return, None returns whole documents.
+    """
+
+    def find_one(self, table, query, projection=None):
+        """Returns the first document matching query, or None"""
+        raise NotImplementedError
+
+    def find_many(self, table, queries, projection=None):
+        """Returns a list with the document (or None) for each query"""
+        return [self.find_one(table, query, projection) for query in queries]
+
+    def exists(self, table, query):
+        """True if a document matches query, without reading the whole document"""
+        return self.find_one(table, query, list(TABLE_KEYS.get(table, ("login",)))) is not None
+
+    def insert(self, table, obj):
+        raise NotImplementedError
+
+    def replace(self, table, query, obj):
+        """Replaces the document matching query with obj or inserts obj.
+        Returns True if a document was replaced"""
+        raise NotImplementedError
+
+    def put_many(self, table, items):
+        """Stores a list of (query, obj) tuples like replace()"""
+        for query, obj in items:
+            self.replace(table, query, obj)
+
+    def update(self, table, query, fields):
+        """Sets the (plain) fields of the document matching query, returns True if one matched"""
+        doc = self.find_one(table, query)
+        if doc is None:
+            return False
+        doc.update(fields)
+        self.replace(table, query, doc)
+        return True
+
+    def delete(self, table, query=None):
+        """Removes the documents matching query, or the whole table"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MongoBackend(CacheBackend):
+    """
+    Stores each table as a collection in mongo-db
+    /<database>/<collection>/<table>
+    with a unique index on the key fields from TABLE_KEYS.
+    The indexes are created on the first access to each table, read or write,
+    so constructing the backend does not contact the server.
+    """
+
+    # max number of values per $in query
+    BATCH_SIZE = 1000
+
+    def __init__(self, db_client=None, database="github", collection="cache", ensure_indexes=True):
+        import pymongo
+        self._db_client = db_client or pymongo.MongoClient()
+        self._cache = self._db_client[database][collection]
+        self._ensure_indexes = ensure_indexes
+        # tables whose indexes exist
+        self._indexed = set()
+        self._index_lock = threading.Lock()
+
+    def ensure_indexes(self, tables=None):
+        """
+        Creates the unique key indexes of the tables (all of TABLE_KEYS by default),
+        falls back to non-unique if a table has duplicates
+        """
+        import pymongo.errors
+        with self._index_lock:
+            for table in TABLE_KEYS if tables is None else tables:
+                if table in self._indexed:
+                    continue
+                keys = TABLE_KEYS.get(table, ("login",))
+                index = [(k, 1) for k in keys]
+                try:
+                    self._cache[table].create_index(index, unique=True)
+                except pymongo.errors.OperationFailure as e:
+                    log.warning("can not create unique index on %s %s: %s", table, keys, e)
+                    self._cache[table].create_index(index)
+                self._indexed.add(table)
+
+    def _collection(self, table):
+        """Returns the collection of the table, with its indexes created on first use"""
+        if self._ensure_indexes and table not in self._indexed:
+            self.ensure_indexes([table])
+        return self._cache[table]
+
+    def find_one(self, table, query, projection=None):
+        return self._collection(table).find_one(query, projection)
+
+    def exists(self, table, query):
+        return self._collection(table).find_one(query, {"_id": 1}) is not None
+
+    def find_many(self, table, queries, projection=None):
+        keys = TABLE_KEYS.get(table, ("login",))
+        if any(set(query) != set(keys) for query in queries):
+            return super().find_many(table, queries, projection)
+        if projection is not None:
+            projection = list(projection) + [k for k in keys if k not in projection]
+        found = dict()
+        for i in range(0, len(queries), self.BATCH_SIZE):
+            batch = queries[i:i + self.BATCH_SIZE]
+            # one $in per key field, compound keys are matched exactly below
+            db_query = {k: {"$in": list({query[k] for query in batch})} for k in keys}
+            for doc in self._collection(table).find(db_query, projection):
+                found.setdefault(tuple(doc.get(k) for k in keys), doc)
+        return [found.get(tuple(query[k] for k in keys)) for query in queries]
+
+    def insert(self, table, obj):
+        self._collection(table).insert_one(obj)
+
+    def replace(self, table, query, obj):
+        return self._collection(table).replace_one(query, obj, upsert=True).matched_count > 0
+
+    def put_many(self, table, items):
+        import pymongo
+        if items:
+            self._collection(table).bulk_write(
+                [pymongo.ReplaceOne(query, obj, upsert=True) for query, obj in items],
+                ordered=False
+            )
+
+    def update(self, table, query, fields):
+        return self._collection(table).update_one(query, {"$set": fields}).matched_count > 0
+
+    def delete(self, table, query=None):
+        if query is not None:
+            self._collection(table).delete_many(query)
+        else:
+            self._cache[table].drop()
+            with self._index_lock:
+                self._indexed.discard(table)
+
+
+class SqliteBackend(CacheBackend):
+    """
+    Embedded store in a single sqlite file in WAL mode.
+    Each cache table is an sqlite table with the key fields from TABLE_KEYS
+    as columns, the json document and the `_blob` of the document in a separate column,
+    which is only read for whole documents.
+    """
+
+    # max number of sql variables per statement
+    BATCH_SIZE = 500
+
+    def __init__(self, filename="github-cache.sqlite", timeout=30.):
+        """
+        :param timeout: seconds to wait for the write lock when several processes share the file
+        """
+        self.filename = filename
+        self._db = sqlite3.connect(filename, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.RLock()
+        self._tables = set()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _keys(table):
+        return TABLE_KEYS.get(table, ("login",))
+
+    def _table(self, table):
+        """Creates the table if needed and returns the quoted name"""
+        name = '"%s"' % table.replace('"', '""')
+        if table not in self._tables:
+            keys = self._keys(table)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS %s (%s, doc TEXT NOT NULL, blob BLOB, PRIMARY KEY (%s))" % (
+                    name,
+                    ", ".join('"%s" TEXT NOT NULL DEFAULT \'\'' % k for k in keys),
+                    ", ".join('"%s"' % k for k in keys),
+                )
+            )
+            # tables of older versions lack the blob column
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(%s)" % name)]
+            if "blob" not in columns:
+                self._db.execute("ALTER TABLE %s ADD COLUMN blob BLOB" % name)
+            self._tables.add(table)
+        return name
+
+    def _key_values(self, table, obj):
+        return tuple(str(obj.get(k, "")) for k in self._keys(table))
+
+    @staticmethod
+    def _doc(doc, blob, projection):
+        if projection is not None:
+            return project(doc, projection)
+        if blob is not None:
+            doc[BLOB_FIELD] = bytes(blob)
+        return doc
+
+    def _select(self, table, query, projection=None):
+        """Returns the matching documents, filtering non-key query fields in python"""
+        keys = self._keys(table)
+        key_query = {k: v for k, v in query.items() if k in keys}
+        rest_query = {k: v for k, v in query.items() if k not in keys}
+        sql = "SELECT doc, %s FROM %s" % ("NULL" if projection is not None else "blob", self._table(table))
+        if key_query:
+            sql += " WHERE " + " AND ".join('"%s" = ?' % k for k in key_query)
+        docs = []
+        for row in self._db.execute(sql, [str(v) for v in key_query.values()]):
+            doc = json.loads(row[0])
+            if all(doc.get(k) == v for k, v in rest_query.items()):
+                docs.append(self._doc(doc, row[1], projection))
+        return docs
+
+    def find_one(self, table, query, projection=None):
+        with self._lock:
+            docs = self._select(table, query, projection)
+        return docs[0] if docs else None
+
+    def exists(self, table, query):
+        if not query or not set(query) <= set(self._keys(table)):
+            return super().exists(table, query)
+        with self._lock:
+            sql = "SELECT 1 FROM %s WHERE %s LIMIT 1" % (
+                self._table(table), " AND ".join('"%s" = ?' % k for k in query))
+            return self._db.execute(sql, [str(v) for v in query.values()]).fetchone() is not None
+
+    def find_many(self, table, queries, projection=None):
+        keys = self._keys(table)
+        if any(set(query) != set(keys) for query in queries):
+            return super().find_many(table, queries, projection)
+        found = dict()
+        with self._lock:
+            name = self._table(table)
+            for i in range(0, len(queries), self.BATCH_SIZE // len(keys)):
+                batch = [self._key_values(table, query) for query in queries[i:i + self.BATCH_SIZE // len(keys)]]
+                sql = "SELECT %s, doc, %s FROM %s WHERE (%s) IN (VALUES %s)" % (
+                    ", ".join('"%s"' % k for k in keys),
+                    "NULL" if projection is not None else "blob", name,
+                    ", ".join('"%s"' % k for k in keys),
+                    ", ".join(["(%s)" % ", ".join("?" * len(keys))] * len(batch)),
+                )
+                for row in self._db.execute(sql, [v for values in batch for v in values]):
+                    found[tuple(row[:-2])] = self._doc(json.loads(row[-2]), row[-1], projection)
+        return [found.get(self._key_values(table, query)) for query in queries]
+
+    def insert(self, table, obj):
+        self.put_many(table, [(obj, obj)])
+
+    def replace(self, table, query, obj):
+        with self._lock:
+            replaced = self.find_one(table, query) is not None
+            if replaced and set(query) != set(self._keys(table)):
+                self.delete(table, query)
+            self.put_many(table, [(query, obj)])
+        return replaced
+
+    def put_many(self, table, items):
+        keys = self._keys(table)
+        with self._lock:
+            name = self._table(table)
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO %s (%s, doc, blob) VALUES (%s)" % (
+                        name, ", ".join('"%s"' % k for k in keys), ", ".join("?" * (len(keys) + 2))),
+                    [self._key_values(table, dict(obj, **query)) + (
+                        json.dumps({k: v for k, v in obj.items() if k != BLOB_FIELD}, default=str),
+                        obj.get(BLOB_FIELD))
+                     for query, obj in items]
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def update(self, table, query, fields):
+        if not fields or set(query) != set(self._keys(table)):
+            return super().update(table, query, fields)
+        with self._lock:
+            # json_set changes the fields in place, the blob is not touched
+            sql = "UPDATE %s SET doc = json_set(doc, %s) WHERE %s" % (
+                self._table(table),
+                ", ".join(["?, ?"] * len(fields)),
+                " AND ".join('"%s" = ?' % k for k in query),
+            )
+            params = [v for key, value in fields.items() for v in ('$."%s"' % key, value)]
+            return self._db.execute(sql, params + [str(v) for v in query.values()]).rowcount > 0
+
+    def delete(self, table, query=None):
+        keys = self._keys(table)
+        with self._lock:
+            name = self._table(table)
+            if query is None:
+                self._db.execute("DELETE FROM %s" % name)
+            elif set(query) <= set(keys):
+                self._db.execute(
+                    "DELETE FROM %s WHERE %s" % (name, " AND ".join('"%s" = ?' % k for k in query)),
+                    [str(v) for v in query.values()]
+                )
+            else:
+                for doc in self._select(table, query):
+                    self._db.execute(
+                        "DELETE FROM %s WHERE %s" % (name, " AND ".join('"%s" = ?' % k for k in keys)),
+                        self._key_values(table, doc)
+                    )
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Bounded in-memory cache of documents per (table, query),
+    dropping the least recently used entries beyond `max_entries`.
+    Thread-safe.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(table, query):
+        return table, tuple(sorted(query.items()))
+
+    def get(self, table, query):
+        """Returns the stored document or None"""
+        key = self._key(table, query)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def contains(self, table, query):
+        """True if a document is stored, without counting a hit or miss"""
+        with self._lock:
+            return self._key(table, query) in self._entries
+
+    def put(self, table, query, data):
+        if self.max_entries <= 0:
+            return
+        key = self._key(table, query)
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, table, query=None):
+        """Removes all entries of the table, or those whose document matches the query"""
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] != table:
+                    continue
+                data = self._entries[key]
+                if query is None or all(data.get(k) == v for k, v in query.items()):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.,
+            }
@@ -0,0 +1,95 @@
+import json
+import sqlite3
+import threading
+import zlib
+
+from requests.structures import CaseInsensitiveDict
+
+
+class CassetteResponse(object):
+    """The parts of a requests.Response that GithubClient uses"""
+
+    from_cassette = True
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+
+class Cassette(object):
+    """
+    Raw http responses of a GithubClient in a single sqlite file,
+    the bodies zlib-compressed.
+
+    Responses are keyed by url, query parameters and the conditional request headers.
+    Modes:
+        "record"    requests go to the network and every response is stored
+        "replay"    responses come from the cassette only, unknown requests get a 404
+        "auto"      replays stored responses, records the others
+    """
+
+    MODES = ("record", "replay", "auto")
+
+    # response headers that are stored
+    HEADERS = (
+        "Link", "ETag", "Last-Modified", "Content-Type", "Retry-After",
+        "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset",
+        "X-RateLimit-Used", "X-RateLimit-Resource",
+    )
+
+    # request headers that change the response
+    REQUEST_HEADERS = ("If-None-Match", "If-Modified-Since")
+
+    def __init__(self, filename, mode="auto", compress_level=6):
+        if mode not in self.MODES:
+            raise ValueError("mode must be one of %s, got %r" % (self.MODES, mode))
+        self.filename = filename
+        self.mode = mode
+        self.compress_level = compress_level
+        self._db = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, status INTEGER NOT NULL, headers TEXT NOT NULL, body BLOB NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @classmethod
+    def key(cls, url, params=None, headers=None):
+        key = url
+        if params:
+            key += ("&" if "?" in url else "?") + "&".join(
+                "%s=%s" % (k, params[k]) for k in sorted(params))
+        for name in cls.REQUEST_HEADERS:
+            if headers and headers.get(name):
+                key += "\n%s: %s" % (name, headers[name])
+        return key
+
+    def play(self, key):
+        """Returns the stored CassetteResponse or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, headers, body FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return CassetteResponse(row[0], json.loads(row[1]), zlib.decompress(row[2]))
+
+    def record(self, key, response):
+        """Stores status, the HEADERS and the body of a requests.Response"""
+        headers = {name: response.headers[name] for name in self.HEADERS if name in response.headers}
+        body = zlib.compress(response.content, self.compress_level)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, status, headers, body) VALUES (?, ?, ?, ?)",
+                (key, response.status_code, json.dumps(headers), body)
+            )
@@ -1,109 +1,406 @@
 import requests
 import json
-import time
+import logging
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .ratelimit import RateLimiter
+from .metrics import Metrics
+from .cassette import Cassette, CassetteResponse
+
+log = logging.getLogger(__name__)
 
 
 class GithubClient(object):
 
-    def __init__(self, auth=None):
+    class Credential:
+        """One account or token of the pool, with its own session and rate-limit buckets"""
+        def __init__(self, auth, limits):
+            self.auth = auth
+            self.session = None
+            self.rate_limiter = RateLimiter(limits)
+            # requests sent with this credential
+            self.num_requests = 0
+            if isinstance(auth, str):
+                self.name = "token-%s" % auth[-4:]
+            else:
+                self.name = auth[0] if auth else "anonymous"
+
+    def __init__(self, auth=None, num_workers=8, metrics=None, base_url="https://api.github.com/",
+                 cassette=None):
         """Just inits class, no connection.
-        auth can be a username:token tupple"""
+        auth can be a username:token tupple, a token string or a list of these,
+        each request uses the credential with the most remaining quota
+        num_workers is the number of requests that get_many() keeps in flight
+        metrics is an optional shared Metrics instance
+        base_url is the api root, e.g. of a github enterprise server
+        cassette is an optional Cassette to record responses to or replay them from,
+        replayed responses are not throttled but count in num_requests"""
         if auth is None:
             try:
-                from .github_credentials import USERNAME, TOKEN
-                auth = (USERNAME, TOKEN)
+                from . import github_credentials
+                auth = getattr(github_credentials, "CREDENTIALS", None) \
+                    or (github_credentials.USERNAME, github_credentials.TOKEN)
             except ImportError:
                 pass
-        self._auth = auth
-        self._session = None
-        self._response = None
-        self.base_url = "https://api.github.com/"
-        self._last_request_time = -1.
-        # logged-in users have 5000 per hour
+        # last response, credential and worker flag per thread
+        self._local = threading.local()
+        # guards session creation
+        self._lock = threading.Lock()
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        # logged-in users have 5000 per hour, the limiters sync with the response headers
         self.num_requests_per_hour = 5000
+        limits = {"core": (self.num_requests_per_hour, 3600)}
+        self.credentials = [
+            GithubClient.Credential(a, limits)
+            for a in (auth if isinstance(auth, list) else [auth])
+        ]
+        self.num_workers = num_workers
+        # number of requests sent by this client
+        self.num_requests = 0
+        self.metrics = metrics or Metrics()
+        self.cassette = cassette
 
     #def __del__(self):
     #    if self._session is not None:
     #        self._session.close()
 
-    def session(self):
-        if self._session is None:
-            self._session = requests.session()
-            self._session.headers.update({"Accept": "application/vnd.github.v3+json"})
-            if self._auth:
-                self._session.auth = self._auth
-                resp = self._session.get(self.base_url + "user")
-                if resp.status_code != 200:
-                    raise RuntimeError("Login failure: %s" % resp.content)
-                resp = json.loads(resp.content.decode("utf-8"))
-                if "login" not in resp:
-                    raise RuntimeError("Login failure: %s" % resp.content)
-                print("logged in as %s" % resp["login"])
-        return self._session
+    @property
+    def rate_limiter(self):
+        """The RateLimiter of the first credential"""
+        return self.credentials[0].rate_limiter
+
+    def session(self, credential=None):
+        """Returns the session of the credential, by default the first one"""
+        credential = credential or self.credentials[0]
+        with self._lock:
+            if credential.session is None:
+                session = requests.session()
+                # one pooled connection per worker
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=max(1, self.num_workers))
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Accept": "application/vnd.github.v3+json"})
+                if credential.auth:
+                    if isinstance(credential.auth, str):
+                        session.headers["Authorization"] = "token %s" % credential.auth
+                    else:
+                        session.auth = credential.auth
+                    resp = session.get(self.base_url + "user")
+                    if resp.status_code != 200:
+                        raise RuntimeError("Login failure: %s" % resp.content)
+                    resp = json.loads(resp.content.decode("utf-8"))
+                    if "login" not in resp:
+                        raise RuntimeError("Login failure: %s" % resp.content)
+                    log.info("logged in as %s", resp["login"])
+                credential.session = session
+        return credential.session
+
+    @property
+    def _response(self):
+        return getattr(self._local, "response", None)
 
     @property
     def headers(self):
-        """Return the last response header fields or None"""
+        """Return the header fields of the last response in the calling thread or None"""
         return self._response.headers if self._response is not None else None
 
-    def get(self, url, params=None):
+    def get_many(self, urls, params=None):
+        """
+        Like get() for a list of urls, with up to num_workers requests in flight.
+        Returns the list of json objects in the order of urls.
+        """
+        return self.map(lambda url: self.get(url, params), urls)
+
+    def map(self, func, items):
+        """
+        Calls func(item) for every item in a pool of num_workers threads
+        and returns the results in the order of items.
+        Calls from within a worker thread are run sequentially.
+        """
+        items = list(items)
+        if self.num_workers <= 1 or len(items) <= 1 or getattr(self._local, "in_worker", False):
+            return [func(item) for item in items]
+
+        def _work(item):
+            self._local.in_worker = True
+            try:
+                return func(item)
+            finally:
+                self._local.in_worker = False
+
+        with ThreadPoolExecutor(max_workers=min(self.num_workers, len(items))) as pool:
+            return list(pool.map(_work, items))
+
+    def get(self, url, params=None, headers=None):
         """
         Returns the json object for the particular url.
         url is like "users/name"
         If result is a list, all pages will be queried.
-        Use is_error() on result to check for api errors.
+        headers are extra request headers for the first page,
+        e.g. {"If-None-Match": etag} for a conditional request.
+        Use is_error() on result to check for api errors,
+        is_not_modified() for the answer to a conditional request
+        and is_incomplete() for a list with a page that failed.
+        Afterwards, `headers` holds the header fields of the first page.
         """
-        wait_sec = 10
-        url = self.base_url + (url[1:] if url.startswith("/") else url)
-        while True:
-            data = self._get(url, params)
-            if self.is_error(data):
-                msg = data["message"]
-                if msg.startswith("API rate limit"):
-                    print("api rate limit reached, waiting %ss" % wait_sec)
-                    time.sleep(wait_sec)
-                    wait_sec *= 2.
-                    continue
-            break
+        data = self._get_retrying(url, params, headers)
         if isinstance(data, list):
-            self._get_more_list(data)
+            response = self._response
+            error = self._get_more_list(data)
+            self._local.response = response
+            if error is not None:
+                log.warning("incomplete list %s: %s", url, error.get("message"))
+                return {"documentation_url": "", "message": "Incomplete list: %s" % error.get("message")}
         return data
 
-    def _get(self, url, params=None):
+    def iter_pages(self, url, params=None, headers=None):
+        """
+        Yields the pages of a list url one by one, like get() without fetching all pages first.
+        The next page is only requested when the previous one was consumed,
+        so a consumer that stops early saves the remaining requests.
+        The first page may be an error object, e.g. is_not_modified() for a conditional request.
+        While iterating, `headers` holds the header fields of the first page.
+        """
+        data = self._get_retrying(url, params, headers)
+        response = self._response
+        yield data
+        if not isinstance(data, list):
+            return
+        links = self._parse_links(response.headers)
+        while "next" in links:
+            data = self._get_retrying(links["next"])
+            links = self._parse_links(self.headers)
+            self._local.response = response
+            yield data
+            if not isinstance(data, list):
+                return
+
+    def _get_retrying(self, url, params=None, headers=None):
+        """_get() which waits and retries when the rate limit is reached"""
+        wait_sec = 10
+        # urls from api objects like an org's "members_url" are absolute
+        if not url.startswith(("http://", "https://")):
+            url = self.base_url + (url[1:] if url.startswith("/") else url)
+        while True:
+            data = self._get(url, params, headers)
+            if self.is_error(data) and self._is_rate_limited(self._response) \
+                    and not getattr(self._response, "from_cassette", False):
+                # next wait() sleeps until the limiter's reset time
+                log.warning("api rate limit reached")
+                self.metrics.inc("rate_limited", label=self._resource(url))
+                self._credential.rate_limiter.backoff(self._resource(url), self.headers, wait_sec)
+                wait_sec *= 2.
+                continue
+            return data
+
+    def _get(self, url, params=None, headers=None):
         """Pure json response object. Use is_error() to check result"""
-        print("session-get: %s" % url + (" %s" % params if params else ""))
-        self.wait()
-        resp = self.session().get(url, params=params)
-        self._response = resp
+        log.debug("session-get: %s %s", url, params or "")
+        endpoint = self._endpoint(url)
+        resp = self._replay(url, params, headers, endpoint)
+        if resp is None:
+            resp = self._request(url, params, headers, endpoint)
+        self.metrics.inc("bytes_received", len(resp.content), endpoint)
+        self._local.response = resp
+        if resp.status_code == 304:
+            return {"documentation_url": "", "message": "Not Modified"}
         if resp.status_code not in (200, 204, 205):
             return {"documentation_url": "", "message": "GET failure: %s %s" % (resp.status_code, resp.content)}
         if resp.status_code == 204:
             return {"documentation_url": "", "message": "No Content"}
-        return json.loads(resp.content.decode("utf-8"))
+        data = json.loads(resp.content.decode("utf-8"))
+        if isinstance(data, list):
+            self.metrics.inc("pages", label=endpoint)
+        return data
+
+    def _request(self, url, params, headers, endpoint):
+        """Sends the request when the rate limit allows and returns the response"""
+        resource = self._resource(url)
+        self.wait(resource)
+        credential = self._credential
+        with self._lock:
+            self.num_requests += 1
+            credential.num_requests += 1
+        resp = None
+        start = time.time()
+        try:
+            resp = self.session(credential).get(url, params=params, headers=headers)
+        finally:
+            credential.rate_limiter.update(resp.headers if resp is not None else None, resource)
+            self.metrics.inc("requests", label=endpoint)
+            self.metrics.inc("credential_requests", label=credential.name)
+            self.metrics.observe("request_seconds", time.time() - start, endpoint)
+            self.metrics.inc("responses", label=resp.status_code if resp is not None else "error")
+        if self.cassette is not None and self.cassette.mode != "replay":
+            self.cassette.record(Cassette.key(url, params, headers), resp)
+        return resp
+
+    def _replay(self, url, params, headers, endpoint):
+        """Returns the response from the cassette, or None if it should be requested"""
+        if self.cassette is None or self.cassette.mode == "record":
+            return None
+        resp = self.cassette.play(Cassette.key(url, params, headers))
+        if resp is None:
+            if self.cassette.mode != "replay":
+                return None
+            log.warning("not in cassette: %s %s", url, params or "")
+            self.metrics.inc("cassette_misses", label=endpoint)
+            resp = CassetteResponse(404, {}, b'{"message": "Not Found"}')
+        with self._lock:
+            self.num_requests += 1
+        self.metrics.inc("replayed", label=endpoint)
+        return resp
 
     def _get_more_list(self, data):
-        """Looks for pagination in response headers and adds more objects to list in data"""
-        while "Link" in self.headers:
-            links = self.headers["Link"]
-            match = re.search(r'<([^>]*)>;\srel="next"', links)
-            if match:
-                nextdata = self._get(match.groups()[0])
-                if not isinstance(nextdata, list):
-                    # assume error
-                    data.clear()
-                    data.append(nextdata)
-                    break
-                data += nextdata
-                continue
-            break
+        """
+        Looks for pagination in response headers and adds more objects to list in data.
+        If the first page links to the last page, all remaining pages are fetched concurrently,
+        otherwise the "next" links are followed one by one.
+        Returns None, or the error object of the first page that failed after retrying.
+        """
+        links = self._parse_links(self.headers)
+        page_urls = self._page_urls(links.get("next"), links.get("last"))
+        if page_urls:
+            pages = self.map(self._get_retrying, page_urls)
+        else:
+            pages = self._iter_next_pages(links)
+        for nextdata in pages:
+            if not isinstance(nextdata, list):
+                # assume error
+                return nextdata if isinstance(nextdata, dict) else {"message": "not a list page"}
+            data += nextdata
+        return None
+
+    def _iter_next_pages(self, links):
+        while "next" in links:
+            nextdata = self._get_retrying(links["next"])
+            yield nextdata
+            links = self._parse_links(self.headers)
+
+    @staticmethod
+    def _parse_links(headers):
+        """Returns a dict of rel -> url from the Link header field"""
+        if not headers or "Link" not in headers:
+            return dict()
+        return {rel: url for url, rel in re.findall(r'<([^>]*)>;\s*rel="([^"]*)"', headers["Link"])}
+
+    @staticmethod
+    def _page_urls(next_url, last_url):
+        """Returns the urls of the pages from next_url to last_url, or None if not numbered"""
+        if not next_url or not last_url:
+            return None
+        page_re = r"([?&]page=)(\d+)"
+        next_page, last_page = re.search(page_re, next_url), re.search(page_re, last_url)
+        if not next_page or not last_page:
+            return None
+        return [
+            re.sub(page_re, lambda m: m.group(1) + str(page), last_url)
+            for page in range(int(next_page.group(2)), int(last_page.group(2)) + 1)
+        ]
 
     @staticmethod
     def is_error(obj):
         return isinstance(obj, dict) and "message" in obj and "documentation_url" in obj
 
-    def wait(self):
-        wait_sec = 3600. / self.num_requests_per_hour
-        while time.time() - self._last_request_time < wait_sec:
+    @classmethod
+    def is_not_modified(cls, obj):
+        """Returns True if obj is the answer to a conditional request for unchanged content"""
+        return cls.is_error(obj) and obj["message"] == "Not Modified"
+
+    @classmethod
+    def is_incomplete(cls, obj):
+        """Returns True if a following page of a list failed, the list should be requested again"""
+        return cls.is_error(obj) and obj["message"].startswith("Incomplete list")
+
+    @staticmethod
+    def _is_rate_limited(resp):
+        if resp is None or resp.status_code not in (403, 429):
+            return False
+        return (resp.headers.get("X-RateLimit-Remaining") == "0"
+                or "Retry-After" in resp.headers
+                or b"rate limit" in resp.content)
+
+    def _resource(self, url):
+        """Returns the rate-limit resource name for the url"""
+        if url.startswith(self.base_url):
+            url = url[len(self.base_url):]
+        return "search" if url.startswith("search/") else "core"
+
+    def _endpoint(self, url):
+        """Returns the url path with placeholders for the names, like repos/:owner/:repo/contributors"""
+        if url.startswith(self.base_url):
+            url = url[len(self.base_url):]
+        parts = url.split("?")[0].strip("/").split("/")
+        if parts[0] in ("users", "orgs") and len(parts) > 1:
+            parts[1] = ":login"
+        elif parts[0] == "repos" and len(parts) > 2:
+            parts[1:3] = [":owner", ":repo"]
+        return "/".join(parts)
+
+    def rate_limit(self, resource=None):
+        """
+        Returns the current rate-limit budget, see RateLimiter.budget().
+        For a pool of credentials, the limits and remaining requests are summed up
+        and the reset is the earliest one.
+        """
+        budgets = [credential.rate_limiter.budget(resource) for credential in self.credentials]
+        if len(budgets) == 1:
+            return budgets[0]
+        if resource is not None:
+            return self._sum_budgets(budgets)
+        resources = sorted({name for budget in budgets for name in budget})
+        return {
+            name: self._sum_budgets([budget[name] for budget in budgets if name in budget])
+            for name in resources
+        }
+
+    @staticmethod
+    def _sum_budgets(budgets):
+        return {
+            "limit": sum(budget["limit"] for budget in budgets),
+            "remaining": sum(budget["remaining"] for budget in budgets),
+            "reset": min(budget["reset"] for budget in budgets),
+        }
+
+    def usage(self):
+        """Returns {credential name: {"requests": number sent, "rate_limit": budget per resource}}"""
+        return {
+            credential.name: {
+                "requests": credential.num_requests,
+                "rate_limit": credential.rate_limiter.budget(),
+            }
+            for credential in self.credentials
+        }
+
+    @property
+    def _credential(self):
+        """The credential of the last wait() in the calling thread"""
+        return getattr(self._local, "credential", None) or self.credentials[0]
+
+    def wait(self, resource="core"):
+        """
+        Takes a token from the credential with the most remaining quota in `resource`.
+        If all are exhausted, sleeps until the first one resets. Buckets are shared by all threads.
+        Returns the seconds slept
+        """
+        slept = 0.
+        while True:
+            credentials = sorted(
+                self.credentials, key=lambda credential: -credential.rate_limiter.remaining(resource))
+            wait_secs = []
+            for credential in credentials:
+                wait_sec = credential.rate_limiter.try_acquire(resource)
+                if not wait_sec:
+                    self._local.credential = credential
+                    if slept:
+                        self.metrics.observe("wait_seconds", slept, resource)
+                    return slept
+                wait_secs.append(wait_sec)
+            wait_sec = min(wait_secs)
+            log.warning("%s rate limit exhausted, waiting %.1fs", resource, wait_sec)
             time.sleep(wait_sec)
-        self._last_request_time = time.time()
+            slept += wait_sec
@@ -0,0 +1,289 @@
+import logging
+import math
+import os
+import pickle
+import signal
+import threading
+import time
+
+from .nodes import GithubNodes
+
+log = logging.getLogger(__name__)
+
+
+class GithubCrawler(object):
+    """
+    Breadth-first crawl driver for GithubNodes.
+
+    The graph is followed one depth level at a time. Each level is processed
+    in batches, most valuable nodes first, and everything a batch is going
+    to request is fetched concurrently through `Github` beforehand.
+
+    Each found node keeps the remaining depth it was reached with, like in the
+    recursive GithubNodes.add_* methods: repos found through events get one level less.
+    A node reached again with a larger depth before it is followed is moved up,
+    so every node is followed with the largest depth it is reached at.
+
+    The crawl stops early when one of the limits is reached and leaves
+    a consistent partial graph, `stop_reason` tells which limit it was.
+
+    With a `checkpoint_file`, the graph and the pending frontier are written
+    every `checkpoint_interval` seconds and when the crawl ends. Ctrl-C stops
+    the crawl after the current node and writes a last checkpoint, a second
+    Ctrl-C aborts immediately. `resume()` continues from the checkpoint.
+    """
+
+    def __init__(self, nodes, max_nodes=None, max_requests=None, max_time=None,
+                 priority=None, batch_size=50, checkpoint_file=None, checkpoint_interval=300):
+        """
+        :param nodes: GithubNodes instance to fill
+        :param max_nodes: stop when the graph has this many nodes
+        :param max_requests: stop after this many network requests
+        :param max_time: stop after this many seconds
+        :param priority: callable(node) returning a number, higher values are followed first,
+            defaults to GithubCrawler.node_value
+        :param batch_size: number of nodes prefetched at once
+        :param checkpoint_file: optional filename for the crawl state
+        :param checkpoint_interval: seconds between checkpoints
+        """
+        self.nodes = nodes
+        self.git = nodes.git
+        self.max_nodes = max_nodes
+        self.max_requests = max_requests
+        self.max_time = max_time
+        self.priority = priority or self.node_value
+        self.batch_size = batch_size
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.stop_reason = None
+        self._interrupted = False
+        self._start_time = None
+        self._start_requests = 0
+        self._last_checkpoint_time = 0
+        # the frontier: node id -> remaining depth of the found nodes not yet followed,
+        # and the nodes per remaining depth in the order they were found
+        self._depths = dict()
+        self._levels = dict()
+
+    @staticmethod
+    def node_value(node):
+        """Repos are valued by stargazers, users and orgs by the strength of their connections"""
+        if node.is_repo():
+            return math.log1p(node.get("stargazers_count") or 0)
+        return sum(edge.strength for edge in node.edges())
+
+    def crawl(self, start, depth=None):
+        """
+        Adds the start nodes and follows their connections level by level.
+        :param start: a node id or list of node ids like "u:login", "o:login" or "r:owner/name",
+            plain logins are added as user or organisation
+        :param depth: follow depth, defaults to nodes.follow_depth
+        :return: the GithubNodes instance
+        """
+        if isinstance(start, str):
+            start = [start]
+        depth = self.nodes.follow_depth if depth is None else depth
+        self._start()
+        level = [node for node in (self._add_start_node(node_id) for node_id in start) if node is not None]
+        return self._run({node.id: depth for node in level})
+
+    def resume(self, checkpoint_file=None):
+        """
+        Restores graph and frontier from the checkpoint file and continues the crawl.
+        The limits apply to the resumed part only.
+        :return: the GithubNodes instance
+        """
+        checkpoint_file = checkpoint_file or self.checkpoint_file
+        with open(checkpoint_file, "rb") as f:
+            state = pickle.load(f)
+        self.nodes.set_state(state["graph"])
+        self.checkpoint_file = checkpoint_file
+        self._start()
+        log.info("resuming crawl at %s nodes, %s pending", len(self.nodes.nodes), len(state["frontier"]))
+        return self._run(state["frontier"])
+
+    def frontier(self):
+        """
+        Returns the found nodes that were not followed as dict of node id -> remaining depth.
+        After a complete crawl that are the nodes with a remaining depth of 0 or less.
+        """
+        return dict(self._depths)
+
+    def checkpoint(self):
+        """Writes graph and frontier to the checkpoint file"""
+        state = {
+            "graph": self.nodes.get_state(),
+            "frontier": self.frontier(),
+        }
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.checkpoint_file)
+        self._last_checkpoint_time = time.time()
+
+    def _start(self):
+        self._start_time = time.time()
+        self._start_requests = self.git.num_requests
+        self._last_checkpoint_time = self._start_time
+        self.stop_reason = None
+        self._interrupted = False
+
+    def _run(self, frontier):
+        self._depths, self._levels = dict(), dict()
+        for node_id, depth in frontier.items():
+            self._queue(self.nodes.nodes[node_id], depth)
+        previous_handler = None
+        if threading.current_thread() is threading.main_thread():
+            previous_handler = signal.signal(signal.SIGINT, self._on_interrupt)
+        try:
+            while not self._check_limits():
+                depth = max((depth for depth in self._levels if depth > 0), default=0)
+                if depth <= 0:
+                    break
+                self._follow_level(depth)
+        finally:
+            if previous_handler is not None:
+                signal.signal(signal.SIGINT, previous_handler)
+        # only written between nodes, an exception in the middle of a node
+        # leaves the last periodic checkpoint in place
+        if self.checkpoint_file:
+            self.checkpoint()
+        if self._interrupted:
+            raise KeyboardInterrupt
+        return self.nodes
+
+    def _on_interrupt(self, signum, frame):
+        log.warning("interrupted, stopping after the current node (Ctrl-C again to abort)")
+        self._interrupted = True
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    def _add_start_node(self, node_id):
+        if node_id.startswith("u:"):
+            return self.nodes.add_user(node_id[2:], 0)
+        if node_id.startswith("o:"):
+            return self.nodes.add_organisation(node_id[2:], 0)
+        if node_id.startswith("r:"):
+            return self.nodes.add_repo(node_id[2:], 0)
+        return self.nodes.add_user_or_org(node_id, 0)
+
+    def _queue(self, node, depth):
+        """Adds the node to the frontier, or moves it to a larger depth"""
+        if depth > self._depths.get(node.id, depth - 1):
+            self._depths[node.id] = depth
+            self._levels.setdefault(depth, []).append(node)
+
+    def _follow_level(self, depth):
+        """Follows the nodes of the level, collecting the nodes they reach in the lower levels"""
+        # without the nodes that were moved to a larger depth,
+        # most valuable last, the list is consumed from the end
+        level = [node for node in self._levels.pop(depth) if self._depths.get(node.id) == depth]
+        level.sort(key=self.priority)
+
+        def _on_node_reached(node, follow_depth, created):
+            # follow_node() passes follow_depth 1, the neighbours are reached with 0 or less
+            if created or node.id in self._depths:
+                self._queue(node, depth - 1 + follow_depth)
+
+        self.nodes.on_node_reached = _on_node_reached
+        try:
+            while level and not self._check_limits():
+                batch = level[-self.batch_size:][::-1]
+                self._prefetch(batch)
+                for node in batch:
+                    if self._check_limits():
+                        break
+                    self.nodes.follow_node(node)
+                    level.pop()
+                    del self._depths[node.id]
+                    if self.checkpoint_file \
+                            and time.time() - self._last_checkpoint_time >= self.checkpoint_interval:
+                        self.checkpoint()
+        finally:
+            self.nodes.on_node_reached = None
+            if level:
+                self._levels[depth] = level
+
+    def _check_limits(self):
+        if self.stop_reason is None:
+            if self._interrupted:
+                self.stop_reason = "interrupted"
+            elif self.max_nodes is not None and len(self.nodes.nodes) >= self.max_nodes:
+                self.stop_reason = "max_nodes"
+            elif self.max_requests is not None \
+                    and self.git.num_requests - self._start_requests >= self.max_requests:
+                self.stop_reason = "max_requests"
+            elif self.max_time is not None and time.time() - self._start_time >= self.max_time:
+                self.stop_reason = "max_time"
+            if self.stop_reason is not None:
+                log.info("crawl stopped at %s nodes: %s", len(self.nodes.nodes), self.stop_reason)
+        return self.stop_reason is not None
+
+    def _prefetch(self, nodes):
+        """Fills the cache with the objects that following the nodes will request"""
+        git = self.git
+
+        # the list urls depend on the login being an organisation,
+        # probe that once instead of in each concurrent list request
+        git.get_organisations([
+            node["login"] for node in nodes if (node.is_user() or node.is_org()) and not node.is_error()
+        ])
+
+        # first the lists of connections
+        calls = []
+        for node in nodes:
+            if node.is_error():
+                continue
+            if node.is_user() or node.is_org():
+                calls += [(git.get_repo_list, node["login"]), (git.get_events, node["login"])]
+                if node.is_org():
+                    calls.append((git.get_organisation_members, node["login"]))
+            elif node.is_repo() and "id" in node.obj:
+                calls.append((git.get_repo_contributors, node.obj))
+        git.run_concurrently(lambda call: call[0](call[1]), calls)
+
+        # then the connected objects, the lists are cached by now
+        users, orgs, repos = set(), set(), set()
+        for node in nodes:
+            if node.is_error():
+                continue
+            if node.is_user() or node.is_org():
+                for repoitem in git.get_repo_list(node["login"]) or []:
+                    if not repoitem.get("fork") or self.nodes.follow_forks:
+                        repos.add(repoitem["full_name"])
+                for event in git.get_events(node["login"]) or []:
+                    if event["type"] in GithubNodes.EVENT_EDGE_TYPES and "repo" in event:
+                        repos.add(event["repo"]["name"])
+                if node.is_org():
+                    for user in git.get_organisation_members(node["login"]) or []:
+                        # members are probed for being an organisation first
+                        orgs.add(user["login"])
+                        if user.get("type") != "Organization":
+                            users.add(user["login"])
+            elif node.is_repo():
+                if "owner" in node.obj:
+                    if node["owner"].get("type", "") == "Organization":
+                        orgs.add(node["owner"]["login"])
+                    else:
+                        users.add(node["owner"]["login"])
+                if "id" in node.obj:
+                    for user in git.get_repo_contributors(node.obj) or []:
+                        users.add(user["login"])
+
+        # don't prefetch beyond the request budget
+        budget = None
+        if self.max_requests is not None:
+            budget = max(0, self.max_requests - (git.num_requests - self._start_requests))
+        users, orgs, repos = sorted(users), sorted(orgs), sorted(name for name in repos if "/" in name)
+        if budget is not None:
+            users = users[:budget]
+            orgs = orgs[:max(0, budget - len(users))]
+            repos = repos[:max(0, budget - len(users) - len(orgs))]
+
+        git.get_users(users)
+        git.get_organisations(orgs)
+        repos = git.get_repos_by_name(repos)
+        # forks are replaced by their source
+        git.get_repos_by_name(sorted({
+            repo["source"]["full_name"] for repo in repos
+            if repo and repo.get("fork") and "source" in repo
+        }))
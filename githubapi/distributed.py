@@ -0,0 +1,192 @@
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+from .api import Github
+from .crawler import GithubCrawler
+from .nodes import GithubNodes
+
+log = logging.getLogger(__name__)
+
+
+class CrawlWorker(object):
+    """
+    Claims "fetch node at depth d" jobs from a shared JobQueue and fills
+    the shared cache of `github` with everything following the node needs.
+    The newly found neighbours are put back into the queue with depth d - 1,
+    or d - 2 for repos found through events, like GithubCrawler does.
+
+    Several workers in different processes or on different hosts can share
+    the queue as long as their Github instances share the cache backend.
+    """
+
+    def __init__(self, github, queue, name=None, batch_size=20, lease_seconds=600, follow_forks=False):
+        """
+        :param github: Github instance, its cache backend is shared with the coordinator
+        :param queue: JobQueue instance
+        :param name: worker name in the queue, defaults to host:pid
+        :param batch_size: number of jobs claimed and prefetched at once
+        :param lease_seconds: time after which claimed jobs are handed to other workers
+        :param follow_forks: like GithubNodes.follow_forks, must match the coordinator
+        """
+        self.git = github
+        self.queue = queue
+        self.name = name or "%s:%s" % (socket.gethostname(), os.getpid())
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.follow_forks = follow_forks
+        self.num_jobs = 0
+
+    def run(self, max_jobs=None, idle_timeout=60., poll_interval=1.):
+        """
+        Processes jobs until the queue is finished, `max_jobs` are done
+        or no job could be claimed for `idle_timeout` seconds.
+        :return: number of jobs processed
+        """
+        idle_since = time.time()
+        while max_jobs is None or self.num_jobs < max_jobs:
+            count = self.batch_size if max_jobs is None else min(self.batch_size, max_jobs - self.num_jobs)
+            jobs = self.queue.claim(self.name, count, self.lease_seconds)
+            if jobs:
+                self.process(jobs)
+                idle_since = time.time()
+                continue
+            # leased jobs may still add work, or come back when their worker died
+            if self.queue.is_finished() or time.time() - idle_since >= idle_timeout:
+                break
+            time.sleep(poll_interval)
+        log.info("worker %s stopped after %s jobs", self.name, self.num_jobs)
+        return self.num_jobs
+
+    def process(self, jobs):
+        """Follows the claimed jobs, grouped by depth, and marks them done or failed"""
+        by_depth = dict()
+        for node_id, depth in jobs:
+            by_depth.setdefault(depth, []).append((node_id, depth))
+        for depth, group in sorted(by_depth.items(), reverse=True):
+            try:
+                neighbours = self._follow([node_id for node_id, depth in group], depth)
+                for neighbour_depth, node_ids in sorted(neighbours.items(), reverse=True):
+                    if neighbour_depth > 0:
+                        self.queue.put(node_ids, neighbour_depth)
+            except Exception as e:
+                log.exception("worker %s failed on %s jobs at depth %s", self.name, len(group), depth)
+                self.queue.fail(self.name, group, repr(e))
+            else:
+                self.queue.done(self.name, group)
+                self.num_jobs += len(group)
+                log.debug("worker %s: %s jobs at depth %s, %s neighbours",
+                          self.name, len(group), depth, len(neighbours))
+
+    def _follow(self, node_ids, depth):
+        """
+        Follows the nodes once in a throwaway graph, with the same code
+        the coordinator assembles the graph with.
+        :return: dict of remaining depth -> ids of the neighbours
+        """
+        nodes = GithubNodes(self.git)
+        nodes.follow_forks = self.follow_forks
+        crawler = GithubCrawler(nodes, batch_size=len(node_ids))
+        crawler.crawl(node_ids, 1)
+        # the crawl started with depth 1 instead of depth
+        neighbours = dict()
+        for node_id, remaining in crawler.frontier().items():
+            neighbours.setdefault(remaining + depth - 1, []).append(node_id)
+        return neighbours
+
+
+class CrawlCoordinator(object):
+    """
+    Seeds a shared JobQueue with the start nodes, waits for the CrawlWorkers
+    to drain it and assembles the graph from the shared cache, without network requests.
+
+        queue = SqliteJobQueue("crawl.queue")
+        coordinator = CrawlCoordinator(Github(cache_backend=SqliteBackend("cache.sqlite")), queue)
+        coordinator.start(["u:defunkt", "o:github"], depth=2)
+        workers = start_workers(4, make_github, make_queue)
+        coordinator.wait()
+        nodes = coordinator.assemble(["u:defunkt", "o:github"], depth=2)
+    """
+
+    def __init__(self, github, queue, follow_forks=False):
+        self.git = github
+        self.queue = queue
+        self.follow_forks = follow_forks
+
+    def start(self, start, depth):
+        """
+        Puts the start nodes into the queue.
+        :param start: a node id or list of node ids like "u:login", "o:login" or "r:owner/name",
+            plain logins are probed for being an organisation
+        """
+        self.queue.put(self._node_ids(start), depth)
+
+    def wait(self, poll_interval=5., timeout=None):
+        """
+        Blocks until no job is pending or leased, logging the progress.
+        :return: the job counts per state
+        """
+        start_time = time.time()
+        while True:
+            counts = self.queue.counts()
+            if not counts.get("pending") and not counts.get("leased"):
+                break
+            if timeout is not None and time.time() - start_time >= timeout:
+                log.warning("stopped waiting for the crawl after %.0fs", timeout)
+                break
+            log.info("crawl jobs: %s", ", ".join("%s %s" % (counts[state], state) for state in sorted(counts)))
+            time.sleep(poll_interval)
+        if counts.get("failed"):
+            log.warning("%s crawl jobs failed", counts["failed"])
+        return counts
+
+    def assemble(self, start, depth, nodes=None):
+        """
+        Builds the graph from the shared cache the workers filled,
+        with the cache backend and schema of the coordinator's Github instance.
+        :param nodes: optional GithubNodes instance to fill, its Github instance should not use the network
+        :return: the GithubNodes instance
+        """
+        if nodes is None:
+            nodes = GithubNodes(Github(
+                use_network=False, cache_backend=self.git.cache_backend,
+                cache_schema=self.git.cache_schema, metrics=self.git.metrics))
+            nodes.follow_forks = self.follow_forks
+        return GithubCrawler(nodes).crawl(self._node_ids(start), depth)
+
+    def _node_ids(self, start):
+        if isinstance(start, str):
+            start = [start]
+        node_ids = []
+        for node_id in start:
+            if node_id[:2] not in ("u:", "o:", "r:"):
+                node_id = ("o:" if self.git.is_organisation(node_id) else "u:") + node_id
+            node_ids.append(node_id)
+        return node_ids
+
+
+def _run_worker(github_factory, queue_factory, worker_kwargs, run_kwargs):
+    logging.basicConfig(level=logging.INFO)
+    CrawlWorker(github_factory(), queue_factory(), **worker_kwargs).run(**run_kwargs)
+
+
+def start_workers(num_workers, github_factory, queue_factory, idle_timeout=60., **worker_kwargs):
+    """
+    Starts CrawlWorkers in separate processes.
+    Connections can't be passed to other processes, so each one creates its own
+    Github and JobQueue by calling the factories, which must be picklable,
+    e.g. module level functions or functools.partial(SqliteJobQueue, "crawl.queue").
+    :return: list of multiprocessing.Process, join() them to wait for the workers
+    """
+    processes = []
+    for i in range(num_workers):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(github_factory, queue_factory, worker_kwargs, {"idle_timeout": idle_timeout}),
+            name="crawl-worker-%s" % i,
+        )
+        process.start()
+        processes.append(process)
+    return processes
@@ -0,0 +1,221 @@
+import sqlite3
+import threading
+import time
+
+
+class JobQueue(object):
+    """
+    Persistent queue of crawl jobs shared by several processes.
+
+    A job is a (node id, depth) tuple like ("u:login", 2), the node id is unique.
+    Putting a known node again only raises its depth, so every node is
+    expanded once with the largest depth it was found at.
+    Workers claim jobs with a lease. Jobs whose lease expired are handed out again,
+    up to `max_attempts` times.
+
+    Job states: "pending", "leased", "done", "failed"
+    """
+
+    def __init__(self, max_attempts=3):
+        self.max_attempts = max_attempts
+
+    def put(self, node_ids, depth):
+        """Adds jobs for the node ids, or raises the depth of known ones"""
+        raise NotImplementedError
+
+    def claim(self, worker, count=1, lease_seconds=600):
+        """Leases up to `count` jobs to the worker, largest depth first. Returns a list of (node id, depth)"""
+        raise NotImplementedError
+
+    def done(self, worker, jobs):
+        """Marks the claimed jobs as done. A job whose depth was raised meanwhile becomes pending again"""
+        raise NotImplementedError
+
+    def fail(self, worker, jobs, error):
+        """Returns the claimed jobs to the queue, or marks them failed after max_attempts"""
+        raise NotImplementedError
+
+    def counts(self):
+        """Returns the number of jobs per state"""
+        raise NotImplementedError
+
+    def is_finished(self):
+        """True if no job is pending or leased"""
+        counts = self.counts()
+        return not counts.get("pending") and not counts.get("leased")
+
+    def clear(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SqliteJobQueue(JobQueue):
+    """Job queue in an sqlite file, for worker processes on one host"""
+
+    def __init__(self, filename="github-crawl.queue", max_attempts=3, timeout=30.):
+        super().__init__(max_attempts)
+        self.filename = filename
+        self._db = sqlite3.connect(filename, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, depth INTEGER NOT NULL, "
+            "state TEXT NOT NULL, worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, depth)")
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _transaction(self, func, *args):
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two processes can't claim the same job
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                ret = func(*args)
+                self._db.execute("COMMIT")
+                return ret
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def put(self, node_ids, depth):
+        self._transaction(self._put, list(node_ids), depth)
+
+    def _put(self, node_ids, depth):
+        self._db.executemany(
+            "INSERT INTO jobs (id, depth, state) VALUES (?, ?, 'pending') "
+            "ON CONFLICT (id) DO UPDATE SET depth = excluded.depth, "
+            "state = CASE WHEN state = 'leased' THEN 'leased' ELSE 'pending' END, attempts = 0 "
+            "WHERE excluded.depth > jobs.depth",
+            [(node_id, depth) for node_id in node_ids]
+        )
+
+    def claim(self, worker, count=1, lease_seconds=600):
+        return self._transaction(self._claim, worker, count, lease_seconds)
+
+    def _claim(self, worker, count, lease_seconds):
+        now = time.time()
+        self._db.execute(
+            "UPDATE jobs SET state = 'failed', error = 'lease expired' "
+            "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, self.max_attempts))
+        jobs = self._db.execute(
+            "SELECT id, depth FROM jobs WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) "
+            "ORDER BY depth DESC LIMIT ?", (now, count)
+        ).fetchall()
+        self._db.executemany(
+            "UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+            [(worker, now + lease_seconds, node_id) for node_id, depth in jobs]
+        )
+        return [tuple(job) for job in jobs]
+
+    def done(self, worker, jobs):
+        self._transaction(self._done, worker, list(jobs))
+
+    def _done(self, worker, jobs):
+        self._db.executemany(
+            "UPDATE jobs SET state = CASE WHEN depth > ? THEN 'pending' ELSE 'done' END, "
+            "worker = NULL, lease_until = NULL, attempts = 0 WHERE id = ? AND worker = ? AND state = 'leased'",
+            [(depth, node_id, worker) for node_id, depth in jobs]
+        )
+
+    def fail(self, worker, jobs, error):
+        self._transaction(self._fail, worker, list(jobs), str(error))
+
+    def _fail(self, worker, jobs, error):
+        self._db.executemany(
+            "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, lease_until = NULL, error = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            [(self.max_attempts, error, node_id, worker) for node_id, depth in jobs]
+        )
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs")
+
+
+class MongoJobQueue(JobQueue):
+    """
+    Job queue in a mongo-db collection, for worker processes on several hosts
+    /<database>/<collection>
+    """
+
+    def __init__(self, db_client=None, database="github", collection="crawl_jobs", max_attempts=3):
+        import pymongo
+        super().__init__(max_attempts)
+        self._db_client = db_client or pymongo.MongoClient()
+        self._jobs = self._db_client[database][collection]
+        self._jobs.create_index([("state", 1), ("depth", -1)])
+
+    def put(self, node_ids, depth):
+        import pymongo
+        requests = []
+        for node_id in node_ids:
+            requests += [
+                pymongo.UpdateOne(
+                    {"_id": node_id},
+                    {"$setOnInsert": {"depth": depth, "state": "pending", "attempts": 0}},
+                    upsert=True),
+                pymongo.UpdateOne(
+                    {"_id": node_id, "depth": {"$lt": depth}, "state": {"$ne": "leased"}},
+                    {"$set": {"depth": depth, "state": "pending", "attempts": 0}}),
+                pymongo.UpdateOne(
+                    {"_id": node_id, "depth": {"$lt": depth}, "state": "leased"},
+                    {"$set": {"depth": depth}}),
+            ]
+        if requests:
+            self._jobs.bulk_write(requests, ordered=True)
+
+    def claim(self, worker, count=1, lease_seconds=600):
+        import pymongo
+        now = time.time()
+        self._jobs.update_many(
+            {"state": "leased", "lease_until": {"$lt": now}, "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"state": "failed", "error": "lease expired"}})
+        jobs = []
+        for i in range(count):
+            job = self._jobs.find_one_and_update(
+                {"$or": [{"state": "pending"}, {"state": "leased", "lease_until": {"$lt": now}}]},
+                {"$set": {"state": "leased", "worker": worker, "lease_until": now + lease_seconds},
+                 "$inc": {"attempts": 1}},
+                sort=[("depth", pymongo.DESCENDING)],
+                return_document=pymongo.ReturnDocument.AFTER,
+            )
+            if job is None:
+                break
+            jobs.append((job["_id"], job["depth"]))
+        return jobs
+
+    def done(self, worker, jobs):
+        for node_id, depth in jobs:
+            query = {"_id": node_id, "worker": worker, "state": "leased"}
+            self._jobs.update_one(
+                dict(query, depth={"$gt": depth}),
+                {"$set": {"state": "pending", "worker": None, "attempts": 0}})
+            self._jobs.update_one(
+                dict(query, depth=depth),
+                {"$set": {"state": "done", "worker": None, "attempts": 0}})
+
+    def fail(self, worker, jobs, error):
+        for node_id, depth in jobs:
+            query = {"_id": node_id, "worker": worker, "state": "leased"}
+            self._jobs.update_one(
+                dict(query, attempts={"$gte": self.max_attempts}),
+                {"$set": {"state": "failed", "worker": None, "error": str(error)}})
+            self._jobs.update_one(
+                query,
+                {"$set": {"state": "pending", "worker": None, "error": str(error)}})
+
+    def counts(self):
+        return {doc["_id"]: doc["count"] for doc in self._jobs.aggregate(
+            [{"$group": {"_id": "$state", "count": {"$sum": 1}}}])}
+
+    def clear(self):
+        self._jobs.delete_many({})
@@ -0,0 +1,123 @@
+import numpy as np
+
+
+def force_layout(num_nodes, edges, lengths, iterations=300, positions=None,
+                 gravitational_constant=2000., spring_constant=.04, central_gravity=.3,
+                 damping=.09, timestep=.5, max_velocity=50.,
+                 exact_limit=2000, grid_size=None, chunk_size=1024, seed=23):
+    """
+    Vectorized force-directed layout with the physics model of the vis.js barnesHut solver:
+    inverse-square repulsion between nodes, springs with a rest length along the
+    edges and a constant pull towards the center.
+
+    Up to `exact_limit` nodes, the repulsion between all node pairs is computed.
+    Above that, nodes are binned into grid_size * grid_size cells of equal node count.
+    Nodes within a cell repel each other exactly, other cells repel with their
+    mass center, a one-level Barnes-Hut approximation.
+
+    :param num_nodes: number of nodes
+    :param edges: sequence of (from index, to index) tuples or (E, 2) array
+    :param lengths: spring rest length per edge
+    :param iterations: number of simulation steps
+    :param positions: optional (num_nodes, 2) start positions
+    :param grid_size: number of cells per axis, defaults to num_nodes ** .25
+    :return: (num_nodes, 2) float array of positions
+    """
+    if num_nodes == 0:
+        return np.zeros((0, 2))
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    src, dst = edges[:, 0], edges[:, 1]
+    lengths = np.asarray(lengths, dtype=np.float64)
+
+    if positions is None:
+        extent = (float(lengths.mean()) if len(lengths) else 100.) * np.sqrt(num_nodes)
+        rng = np.random.default_rng(seed)
+        pos = rng.uniform(-extent / 2, extent / 2, (num_nodes, 2))
+    else:
+        pos = np.array(positions, dtype=np.float64).reshape(num_nodes, 2)
+    velocity = np.zeros_like(pos)
+
+    if grid_size is None:
+        grid_size = max(2, int(np.ceil(num_nodes ** .25)))
+
+    for i in range(iterations):
+        if num_nodes <= exact_limit:
+            force = _exact_repulsion(pos, gravitational_constant, chunk_size)
+        else:
+            force = _grid_repulsion(pos, gravitational_constant, grid_size, chunk_size)
+
+        # springs pull or push towards the rest length
+        delta = pos[dst] - pos[src]
+        dist = np.sqrt((delta ** 2).sum(axis=1)) + 1e-9
+        spring = delta * (spring_constant * (dist - lengths) / dist)[:, None]
+        for axis in range(2):
+            force[:, axis] += np.bincount(src, spring[:, axis], num_nodes)
+            force[:, axis] -= np.bincount(dst, spring[:, axis], num_nodes)
+
+        dist = np.sqrt((pos ** 2).sum(axis=1)) + 1e-9
+        force -= pos * (central_gravity / dist)[:, None]
+
+        velocity = (velocity + force * timestep) * (1. - damping)
+        speed = np.sqrt((velocity ** 2).sum(axis=1)) + 1e-9
+        velocity *= (np.minimum(speed, max_velocity) / speed)[:, None]
+        pos += velocity * timestep
+
+    return pos
+
+
+def _repulsion(pos, others, gravitational_constant, mass=1.):
+    """Force on the (n, 2) positions from the (m, 2) other masses"""
+    dx = pos[:, 0, None] - others[None, :, 0]
+    dy = pos[:, 1, None] - others[None, :, 1]
+    dist2 = dx * dx + dy * dy
+    # coincident points, including each node with itself, don't repel
+    weight = np.divide(gravitational_constant * mass, dist2 * np.sqrt(dist2),
+                       out=np.zeros_like(dist2), where=dist2 > 1e-6)
+    # sum_j weight_ij * (pos_i - others_j)
+    return pos * weight.sum(axis=1)[:, None] - weight @ others
+
+
+def _exact_repulsion(pos, gravitational_constant, chunk_size):
+    force = np.zeros_like(pos)
+    for start in range(0, len(pos), chunk_size):
+        force[start:start + chunk_size] = _repulsion(pos[start:start + chunk_size], pos, gravitational_constant)
+    return force
+
+
+def _grid_repulsion(pos, gravitational_constant, grid_size, chunk_size):
+    num_nodes = len(pos)
+    # cells with an equal number of nodes: slabs along x, each split along y
+    slab = np.empty(num_nodes, dtype=np.int64)
+    slab[np.argsort(pos[:, 0], kind="stable")] = np.arange(num_nodes) * grid_size // num_nodes
+    order = np.lexsort((pos[:, 1], slab))
+    slab_sorted = slab[order]
+    rank_in_slab = np.arange(num_nodes) - np.searchsorted(slab_sorted, slab_sorted)
+    slab_size = np.bincount(slab, minlength=grid_size)[slab_sorted]
+    cell = np.empty(num_nodes, dtype=np.int64)
+    cell[order] = slab_sorted * grid_size + rank_in_slab * grid_size // slab_size
+
+    # mass centers of the occupied cells
+    mass = np.bincount(cell, minlength=grid_size * grid_size).astype(np.float64)
+    occupied = np.nonzero(mass)[0]
+    mass = mass[occupied]
+    centers = np.stack([
+        np.bincount(cell, pos[:, axis], grid_size * grid_size)[occupied] / mass
+        for axis in range(2)
+    ], axis=1)
+    own = np.searchsorted(occupied, cell)
+
+    force = np.zeros_like(pos)
+    # far field from all other cells
+    for start in range(0, num_nodes, chunk_size):
+        rows = slice(start, start + chunk_size)
+        cell_mass = np.tile(mass, (len(own[rows]), 1))
+        cell_mass[np.arange(len(cell_mass)), own[rows]] = 0.
+        force[rows] = _repulsion(pos[rows], centers, gravitational_constant, cell_mass)
+
+    # near field between the nodes of the same cell, which are contiguous in `order`
+    bounds = np.searchsorted(own[order], np.arange(len(occupied) + 1))
+    for i in range(len(occupied)):
+        members = order[bounds[i]:bounds[i + 1]]
+        if len(members) > 1:
+            force[members] += _exact_repulsion(pos[members], gravitational_constant, chunk_size)
+    return force
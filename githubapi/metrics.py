@@ -0,0 +1,176 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """Counts of observed values in fixed buckets, plus count, sum, min and max"""
+
+    # upper bounds in seconds
+    DEFAULT_BOUNDS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        # the last bucket holds the values above all bounds
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        """Upper bound of the bucket containing the q-th percentile, q in [0, 100]"""
+        if not self.count:
+            return None
+        rank = q / 100. * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": dict(zip([str(b) for b in self.bounds] + ["inf"], self.buckets)),
+        }
+
+
+class Metrics(object):
+    """
+    Thread-safe counters and histograms, each by name and an optional label
+    like the api endpoint or the cache table.
+
+    Names used by GithubClient and Github:
+        requests, request_seconds, bytes_received, pages    by endpoint
+        responses                                           by status code
+        rate_limited, wait_seconds                          by rate-limit resource
+        cache_memory_hits, cache_backend_hits,
+        cache_misses, cache_stores,
+        cache_read_seconds, cache_write_seconds             by table
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict()
+        self._histograms = dict()
+        self._start_time = time.time()
+        self._report_thread = None
+        self._report_stop = None
+
+    def inc(self, name, value=1, label=None):
+        with self._lock:
+            counter = self._counters.setdefault(name, dict())
+            counter[label] = counter.get(label, 0) + value
+
+    def observe(self, name, value, label=None):
+        with self._lock:
+            histograms = self._histograms.setdefault(name, dict())
+            if label not in histograms:
+                histograms[label] = Histogram()
+            histograms[label].observe(value)
+
+    @contextmanager
+    def timer(self, name, label=None):
+        """Observes the seconds spent in the with-block"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, label)
+
+    def counter(self, name, label=None):
+        """Returns the value of one counter, or the sum over all labels if label is None"""
+        with self._lock:
+            counter = self._counters.get(name, {})
+            if label is None:
+                return sum(counter.values())
+            return counter.get(label, 0)
+
+    def snapshot(self):
+        """
+        Returns {"uptime": seconds, "counters": {name: {label: value}},
+        "histograms": {name: {label: Histogram.as_dict()}}}
+        """
+        with self._lock:
+            return {
+                "uptime": time.time() - self._start_time,
+                "counters": {name: dict(counter) for name, counter in self._counters.items()},
+                "histograms": {
+                    name: {label: histogram.as_dict() for label, histogram in histograms.items()}
+                    for name, histograms in self._histograms.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._start_time = time.time()
+
+    def summary(self):
+        """One line with the totals that tell where the time goes"""
+        with self._lock:
+            def _count(name):
+                return sum(self._counters.get(name, {}).values())
+
+            def _seconds(name):
+                return sum(h.sum for h in self._histograms.get(name, {}).values())
+
+            uptime = max(1e-9, time.time() - self._start_time)
+            num_requests = _count("requests")
+            lookups = _count("cache_memory_hits") + _count("cache_backend_hits") + _count("cache_misses")
+            hits = _count("cache_memory_hits") + _count("cache_backend_hits")
+            return (
+                "%.0fs: %s requests (%.1f/s, %.1fs network), %s pages, %.1f kb, "
+                "cache hit rate %.0f%% (%.1fs read, %.1fs write), "
+                "%s rate limited, %.1fs waiting" % (
+                    uptime, num_requests, num_requests / uptime, _seconds("request_seconds"),
+                    _count("pages"), _count("bytes_received") / 1024.,
+                    100. * hits / lookups if lookups else 0.,
+                    _seconds("cache_read_seconds"), _seconds("cache_write_seconds"),
+                    _count("rate_limited"), _seconds("wait_seconds"),
+                )
+            )
+
+    def report(self, logger=None, level=logging.INFO):
+        (logger or log).log(level, self.summary())
+
+    def start_report(self, interval=60., logger=None, level=logging.INFO):
+        """Logs the summary every `interval` seconds in a daemon thread"""
+        self.stop_report()
+        stop = threading.Event()
+
+        def _loop():
+            while not stop.wait(interval):
+                self.report(logger, level)
+
+        self._report_stop = stop
+        self._report_thread = threading.Thread(target=_loop, name="metrics-report", daemon=True)
+        self._report_thread.start()
+
+    def stop_report(self):
+        if self._report_thread is not None:
+            self._report_stop.set()
+            self._report_thread.join()
+            self._report_thread = None
+            self._report_stop = None
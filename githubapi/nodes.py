@@ -1,5 +1,11 @@
+import gc
 import math
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from operator import itemgetter
 from .api import Github
+from .snapshot import save_snapshot, load_snapshot, SNAPSHOT_FIELDS
 
 
 class GithubNodes(object):
@@ -16,55 +22,215 @@ class GithubNodes(object):
     E_COMMENTED_ON = "commented"
     E_FORK_OF = "forkof"
 
-    class Node:
+    EDGE_TYPES = (E_MEMBER_OF, E_CONTRIBUTES_TO, E_OWNS, E_FORKED, E_PUSHED_TO, E_COMMENTED_ON, E_FORK_OF)
+
+    # event type -> edge type of the events that are followed
+    EVENT_EDGE_TYPES = {
+        "PushEvent": E_PUSHED_TO,
+        "IssueCommentEvent": E_COMMENTED_ON,
+    }
+
+    # edge type -> bit of Edge._types, other types get the next free bits
+    _TYPE_BITS = {name: 1 << i for i, name in enumerate(EDGE_TYPES)}
+    # bitmask -> frozenset of type names
+    _TYPE_SETS = dict()
+
+    @classmethod
+    def _type_bit(cls, type):
+        bit = cls._TYPE_BITS.get(type)
+        if bit is None:
+            bit = cls._TYPE_BITS.setdefault(type, 1 << len(cls._TYPE_BITS))
+        return bit
+
+    @classmethod
+    def _type_set(cls, mask):
+        types = cls._TYPE_SETS.get(mask)
+        if types is None:
+            types = frozenset(name for name, bit in list(cls._TYPE_BITS.items()) if mask & bit)
+            cls._TYPE_SETS[mask] = types
+        return types
+
+    class Node(object):
         """
         Node in the graph
-        obj represents the github data
+        obj represents the github data, attrs holds computed values like the analytics results.
+        With GithubNodes.max_resident, obj is read from the cache again after it was evicted.
         """
+        __slots__ = ("id", "_obj", "_p", "_attrs")
+
         def __init__(self, id, obj, _p):
             self.id = id
-            self.obj = obj
+            self._obj = obj
             self._p = _p
+            self._attrs = None
+        @property
+        def obj(self):
+            obj = self._obj
+            if obj is None:
+                obj = self._p._load_obj(self)
+            return obj
+        @property
+        def attrs(self):
+            if self._attrs is None:
+                self._attrs = dict()
+            return self._attrs
+        @attrs.setter
+        def attrs(self, attrs): self._attrs = attrs
         def __hash__(self): return hash(self.id)
         def __repr__(self): return self.id
         def is_user(self): return self.id.startswith("u:")
         def is_org(self): return self.id.startswith("o:")
         def is_repo(self): return self.id.startswith("r:")
-        def is_error(self): return "error" in self.obj
-        def edges_in(self): return [self._p.edges[e] for e in self._p.edges if self._p.edges[e].to_node == self]
-        def edges_out(self): return [self._p.edges[e] for e in self._p.edges if self._p.edges[e].from_node == self]
+        def is_cluster(self): return self.id.startswith("c:")
+        # error nodes are never evicted
+        def is_error(self): return self._obj is not None and "error" in self._obj
+        def edges_in(self): return list(self._p._edges_in.get(self.id, ()))
+        def edges_out(self): return list(self._p._edges_out.get(self.id, ()))
         def edges(self): return self.edges_in() + self.edges_out()
+        def in_degree(self): return len(self._p._edges_in.get(self.id, ()))
+        def out_degree(self): return len(self._p._edges_out.get(self.id, ()))
+        def degree(self): return self.in_degree() + self.out_degree()
+        def neighbors_in(self): return (e.from_node for e in self._p._edges_in.get(self.id, ()))
+        def neighbors_out(self): return (e.to_node for e in self._p._edges_out.get(self.id, ()))
+        def neighbors(self):
+            """Iterates all adjacent nodes, a node connected both ways is yielded once"""
+            seen = set()
+            for n in itertools.chain(self.neighbors_in(), self.neighbors_out()):
+                if n.id not in seen:
+                    seen.add(n.id)
+                    yield n
         def __getitem__(self, item): return self.obj[item]
         def get(self, key, defaultval=None): return self.obj.get(key, defaultval)
 
-    class Edge:
+    class Edge(object):
+        """Edge in the graph, the types are stored as bitmask"""
+        __slots__ = ("from_node", "to_node", "_types", "strength")
+
         def __init__(self, from_node, to_node, type, strength=None):
             self.from_node = from_node
             self.to_node = to_node
-            self.types = { type }
+            self._types = GithubNodes._type_bit(type)
             self.strength = 1. if strength is None else strength
+        @property
+        def types(self): return GithubNodes._type_set(self._types)
+        def add_type(self, type): self._types |= GithubNodes._type_bit(type)
+        def has_type(self, type): return bool(self._types & GithubNodes._type_bit(type))
         def __hash__(self): return hash((self.from_node, self.to_node))
-        def __repr__(self): return "(%s %s %s)" % (self.from_node, "/".join(self.types), self.to_node)
-        def is_owner(self): return GithubNodes.E_OWNS in self.types
-        def is_contributer(self): return GithubNodes.E_CONTRIBUTES_TO in self.type
-        def is_member(self): return GithubNodes.E_MEMBER_OF in self.types
+        def __repr__(self): return "(%s %s %s)" % (self.from_node, "/".join(sorted(self.types)), self.to_node)
+        def is_owner(self): return self.has_type(GithubNodes.E_OWNS)
+        def is_contributer(self): return self.has_type(GithubNodes.E_CONTRIBUTES_TO)
+        def is_member(self): return self.has_type(GithubNodes.E_MEMBER_OF)
 
-    def __init__(self, github_api=None, follow_depth=1):
+    def __init__(self, github_api=None, follow_depth=1, max_resident=None):
+        """
+        :param max_resident: optional number of node objects held in memory,
+            the oldest ones are dropped and read from the cache on their next use.
+            Only objects of added users, orgs and repos that the cache can return again are dropped,
+            so changes to node.obj may get lost.
+        """
         self.git = github_api or Github()
         self.nodes = dict()
         self.edges = dict()
+        # adjacency index: node id -> [Edge]
+        self._edges_in = dict()
+        self._edges_out = dict()
         self.follow_depth = follow_depth
         self.follow_forks = False
+        # optional callable(node, follow_depth, created) called whenever an add_* method
+        # reaches a node, with the follow depth it was reached with
+        self.on_node_reached = None
+        self.max_resident = max_resident
+        # the nodes whose object may be dropped, oldest first
+        self._resident = deque()
 
     def dump(self):
         print("NODES:\n", list(self.nodes.values()))
         print("EDGES:\n", list(self.edges.values()))
 
+    def get_state(self):
+        """Returns nodes and edges as plain python objects, see set_state()"""
+        return {
+            "nodes": [(node.id, node.obj) for node in self.nodes.values()],
+            "edges": [(edge.from_node.id, edge.to_node.id, sorted(edge.types), edge.strength)
+                      for edge in self.edges.values()],
+        }
+
+    def save(self, filename, fields=SNAPSHOT_FIELDS):
+        """
+        Writes nodes and edges to a compact binary snapshot file.
+        :param fields: the object fields to keep, None for the whole objects
+        """
+        save_snapshot(self, filename, fields)
+
+    def load(self, filename):
+        """Replaces all nodes and edges with the ones from a snapshot file"""
+        load_snapshot(self, filename)
+
+    def analyze(self, type_weights=None, directed=False):
+        """
+        Computes pagerank, centralities, components and communities into the attrs of each node.
+        See analytics.analyze()
+        """
+        from .analytics import analyze
+        return analyze(self, type_weights=type_weights, directed=directed)
+
+    def set_state(self, state):
+        """Replaces all nodes and edges with the ones from get_state()"""
+        node_ids, objs = _columns(state["nodes"], 2)
+        from_ids, to_ids, types, strengths = _columns(state["edges"], 4)
+        index = {node_id: i for i, node_id in enumerate(node_ids)}
+        # without keeping a tuple per edge, many new container objects would trigger the garbage collector
+        masks = {names: GithubNodes._type_mask(names) for names in set(map(tuple, types))}
+        self._set_graph(
+            node_ids, objs,
+            list(map(index.__getitem__, from_ids)), list(map(index.__getitem__, to_ids)),
+            list(map(masks.__getitem__, map(tuple, types))), strengths,
+        )
+
+    @staticmethod
+    def _type_mask(types):
+        mask = 0
+        for type in types:
+            mask |= GithubNodes._type_bit(type)
+        return mask
+
+    def _set_graph(self, node_ids, objs, edge_from, edge_to, edge_types, edge_strength):
+        """
+        Replaces all nodes and edges in bulk, the edges are given as columns
+        of node indices, type bitmasks and strengths
+        """
+        with _gc_paused():
+            Node, Edge = GithubNodes.Node, GithubNodes.Edge
+            node_list = [Node(node_id, obj, self) for node_id, obj in zip(node_ids, objs)]
+            self.nodes = dict(zip(node_ids, node_list))
+            # the objects of a state are not necessarily cached, they stay resident
+            self._resident = deque()
+            new_edge = Edge.__new__
+            edge_list = []
+            edges_out = [[] for _ in node_list]
+            edges_in = [[] for _ in node_list]
+            # same as _add_edge for each edge, without the checks
+            for i_from, i_to, mask, strength in zip(edge_from, edge_to, edge_types, edge_strength):
+                edge = new_edge(Edge)
+                edge.from_node = node_list[i_from]
+                edge.to_node = node_list[i_to]
+                edge._types = mask
+                edge.strength = strength
+                edge_list.append(edge)
+                edges_out[i_from].append(edge)
+                edges_in[i_to].append(edge)
+            self.edges = dict(zip(
+                zip(map(node_ids.__getitem__, edge_from), map(node_ids.__getitem__, edge_to)),
+                edge_list
+            ))
+            self._edges_out = {node_id: node_edges for node_id, node_edges in zip(node_ids, edges_out) if node_edges}
+            self._edges_in = {node_id: node_edges for node_id, node_edges in zip(node_ids, edges_in) if node_edges}
+
     def add_user_or_org(self, login, follow_depth=None):
-        if "u:" + login in self.nodes:
-            return self.nodes["u:" + login]
-        if "o:" + login in self.nodes:
-            return self.nodes["o:" + login]
+        for node_id in ("u:" + login, "o:" + login):
+            if node_id in self.nodes:
+                self._reached(self.nodes[node_id], follow_depth, False)
+                return self.nodes[node_id]
         if self.git.is_organisation(login):
             return self.add_organisation(login, follow_depth)
         else:
@@ -76,17 +242,19 @@ class GithubNodes(object):
             lambda: login_or_user["login"],
             lambda: self.git.get_user(login_or_user),
         )
+        self._reached(user_node, follow_depth, created)
         if not created:
             return user_node
 
-        follow_depth = self.follow_depth if follow_depth is None else follow_depth
+        self._follow_user(user_node, self.follow_depth if follow_depth is None else follow_depth)
+        return user_node
+
+    def _follow_user(self, user_node, follow_depth):
         if follow_depth > 0:
             follow_depth = follow_depth - 1
             self._add_repos(user_node, follow_depth)
             self._add_events(user_node, follow_depth)
 
-        return user_node
-
     def add_repo(self, repo_or_full_name, follow_depth=None):
         def _get_repo():
             assert "/" in repo_or_full_name
@@ -107,10 +275,14 @@ class GithubNodes(object):
             lambda: repo_or_full_name["full_name"],
             _get_repo,
         )
+        self._reached(repo_node, follow_depth, created)
         if not created:
             return repo_node
 
-        follow_depth = self.follow_depth if follow_depth is None else follow_depth
+        self._follow_repo(repo_node, self.follow_depth if follow_depth is None else follow_depth)
+        return repo_node
+
+    def _follow_repo(self, repo_node, follow_depth):
         if follow_depth > 0:
             follow_depth = follow_depth - 1
 
@@ -139,7 +311,6 @@ class GithubNodes(object):
                                 repo_node,
                                 GithubNodes.E_CONTRIBUTES_TO,
                                 norm_contribs)
-        return repo_node
 
     def add_organisation(self, login_or_org, follow_depth=None):
         org_node, created = self._add_node(
@@ -147,10 +318,14 @@ class GithubNodes(object):
             lambda: login_or_org["login"],
             lambda: self.git.get_organisation(login_or_org),
         )
+        self._reached(org_node, follow_depth, created)
         if not created:
             return org_node
 
-        follow_depth = self.follow_depth if follow_depth is None else follow_depth
+        self._follow_organisation(org_node, self.follow_depth if follow_depth is None else follow_depth)
+        return org_node
+
+    def _follow_organisation(self, org_node, follow_depth):
         if follow_depth > 0:
             follow_depth = follow_depth - 1
 
@@ -164,7 +339,18 @@ class GithubNodes(object):
                         self.add_user_or_org(user["login"], follow_depth),
                         org_node,
                         GithubNodes.E_MEMBER_OF)
-        return org_node
+
+    def follow_node(self, node, follow_depth=1):
+        """
+        Follows the connections of an existing node, like the add_* methods do for new nodes.
+        With the default follow_depth of 1 the neighbours are added but not followed.
+        """
+        if node.is_user():
+            self._follow_user(node, follow_depth)
+        elif node.is_org():
+            self._follow_organisation(node, follow_depth)
+        elif node.is_repo():
+            self._follow_repo(node, follow_depth)
 
     def _add_repos(self, user_node, follow_depth):
         repos = self.git.get_repo_list(user_node["login"])
@@ -182,10 +368,7 @@ class GithubNodes(object):
                     )
 
     def _add_events(self, user_node, follow_depth):
-        event_mapping = {
-            "PushEvent": GithubNodes.E_PUSHED_TO,
-            "IssueCommentEvent": GithubNodes.E_COMMENTED_ON,
-        }
+        event_mapping = GithubNodes.EVENT_EDGE_TYPES
         events = self.git.get_events(user_node["login"])
         if events:
             for event in events:
@@ -195,6 +378,47 @@ class GithubNodes(object):
                         repo_node = self.add_repo(repo_name, follow_depth - 1)
                         self._add_edge(user_node, repo_node, event_mapping[event["type"]])
 
+    def sync_events(self, nodes=None):
+        """
+        Polls the new events of users and organisations with Github.sync_events
+        and applies them, see apply_events().
+        :param nodes: the nodes to poll, defaults to those whose events were followed, i.e. are cached
+        :return: the edge delta of all nodes
+        """
+        if nodes is None:
+            nodes = [
+                node for node in self.nodes.values()
+                if (node.is_user() or node.is_org()) and not node.is_error()
+                and self.git.is_cached("events", {"login": node["login"]})
+            ]
+        delta = []
+        for node in nodes:
+            events = self.git.sync_events(node["login"])
+            if events:
+                delta += self.apply_events(node, events)
+        return delta
+
+    def apply_events(self, user_node, events):
+        """
+        Adds or strengthens the edges of new events of a user or organisation node, like following
+        its events does. Repos that are not in the graph yet are added without following them.
+        :return: the edge delta, a list of (edge, type, added strength, True if the edge is new), oldest event first
+        """
+        event_mapping = GithubNodes.EVENT_EDGE_TYPES
+        delta = []
+        for event in reversed(events):
+            if event["type"] not in event_mapping or "repo" not in event:
+                continue
+            repo_node = self.add_repo(event["repo"]["name"], 0)
+            if repo_node is None:
+                continue
+            existing = self.edges.get((user_node.id, repo_node.id))
+            strength = existing.strength if existing is not None else 0.
+            type = event_mapping[event["type"]]
+            edge = self._add_edge(user_node, repo_node, type)
+            delta.append((edge, type, edge.strength - strength, existing is None))
+        return delta
+
     def _add_node(self, node_id_prefix, obj_or_str, id_fallback, obj_fallback):
         if isinstance(obj_or_str, str):
             node_id = node_id_prefix + obj_or_str
@@ -211,8 +435,14 @@ class GithubNodes(object):
 
         node = GithubNodes.Node(node_id, obj, self)
         self.nodes[node_id] = node
+        if self.max_resident is not None and self._is_reloadable(node_id, obj):
+            self._make_resident(node)
         return node, True
 
+    def _reached(self, node, follow_depth, created):
+        if self.on_node_reached is not None and node is not None:
+            self.on_node_reached(node, self.follow_depth if follow_depth is None else follow_depth, created)
+
     def _add_edge(self, from_node, to_node, type, strength=None):
         key = (from_node.id, to_node.id)
         if strength is None:
@@ -221,12 +451,63 @@ class GithubNodes(object):
                 strength = .1
         # if edge exists just update values
         if key in self.edges:
-            self.edges[key].types.add(type)
+            self.edges[key].add_type(type)
             #self.edges[key].strength = max(self.edges[key].strength, strength)
             self.edges[key].strength += strength
             return self.edges[key]
         edge = GithubNodes.Edge(from_node, to_node, type, strength)
         self.edges[key] = edge
+        self._edges_out.setdefault(from_node.id, []).append(edge)
+        self._edges_in.setdefault(to_node.id, []).append(edge)
         return edge
 
+    @staticmethod
+    def _is_reloadable(node_id, obj):
+        """True if the cache returns obj for the node id, forks replaced by their source are not"""
+        if "error" in obj:
+            return False
+        if node_id.startswith("r:"):
+            return obj.get("full_name") == node_id[2:]
+        return node_id[:2] in ("u:", "o:") and obj.get("login") == node_id[2:]
+
+    def _make_resident(self, node):
+        if self.max_resident is None:
+            return
+        self._resident.append(node)
+        while len(self._resident) > self.max_resident:
+            old = self._resident.popleft()
+            if self.nodes.get(old.id) is old:
+                old._obj = None
+
+    def _load_obj(self, node):
+        """Reads the dropped object of a node from the cache"""
+        name = node.id[2:]
+        if node.is_repo():
+            login, repo_name = name.split("/", 1)
+            obj = self.git.get_cached("repo", {"login": login, "name": repo_name})
+        else:
+            obj = self.git.get_cached("org" if node.is_org() else "user", {"login": name})
+        if obj is None:
+            raise KeyError("the object of node %s is no longer in the cache" % node.id)
+        node._obj = obj
+        self._make_resident(node)
+        return obj
+
+
+def _columns(rows, num_columns):
+    """Returns the columns of an iterable of equally sized tuples"""
+    if not isinstance(rows, (list, tuple)):
+        rows = list(rows)
+    return [list(map(itemgetter(i), rows)) for i in range(num_columns)]
+
 
+@contextmanager
+def _gc_paused():
+    """The cyclic garbage collector would scan a growing graph over and over"""
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
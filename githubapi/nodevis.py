@@ -1,14 +1,49 @@
-import math, os
+import math, os, re, json
+
+from .reduce import reduce_graph
 
 
 class NodeVis(object):
 
-    def __init__(self, nodes):
+    def __init__(self, nodes, layout=False, collapse_degree=None, top_k_edges=None, min_degree=None):
+        """
+        :param layout: if True, node positions are computed with compute_layout()
+            and the browser's physics simulation is disabled
+        :param collapse_degree, top_k_edges, min_degree: reduce the graph before display,
+            see reduce.reduce_graph()
+        """
+        if collapse_degree is not None or top_k_edges is not None or min_degree is not None:
+            nodes = reduce_graph(
+                nodes, collapse_degree=collapse_degree, top_k_edges=top_k_edges, min_degree=min_degree)
         self.nodes = nodes
         self.rest_length = 20.
+        self.layout = layout
+        # node id -> (x, y)
+        self.positions = None
+
+    def compute_layout(self, iterations=300, **kwargs):
+        """
+        Computes fixed node positions with a force-directed layout in numpy,
+        using the edge lengths of vis_edges() as spring lengths.
+        See layout.force_layout() for the kwargs.
+        """
+        from .layout import force_layout
+        node_ids = list(self.nodes.nodes)
+        index = {node_id: i for i, node_id in enumerate(node_ids)}
+        edges = list(self.nodes.edges.values())
+        pos = force_layout(
+            len(node_ids),
+            [(index[edge.from_node.id], index[edge.to_node.id]) for edge in edges],
+            [self._edge_length(edge) for edge in edges],
+            iterations=iterations, **kwargs
+        )
+        self.positions = {node_id: (float(x), float(y)) for node_id, (x, y) in zip(node_ids, pos)}
+        return self.positions
 
     def vis_nodes(self):
-        ret = []
+        return list(self.iter_vis_nodes())
+
+    def iter_vis_nodes(self):
         for node in self.nodes.nodes.values():
             entry = {
                 "id": node.id,
@@ -26,20 +61,26 @@ class NodeVis(object):
                     "shape": "box",
                     "color": "#cec",
                 })
+            if node.is_cluster():
+                entry.update({
+                    "shape": "box",
+                    "color": "#9c9",
+                    "borderWidth": 3,
+                })
             if node.is_error():
                 entry.update({
                     "color": "#f0f0f0",
                 })
-            ret.append(entry)
-        return ret
+            if self.positions and node.id in self.positions:
+                entry["x"], entry["y"] = self.positions[node.id]
+            yield entry
 
     def vis_edges(self):
-        ret = []
+        return list(self.iter_vis_edges())
+
+    def iter_vis_edges(self):
         for edge in self.nodes.edges.values():
-            num1 = len(edge.from_node.edges())
-            num2 = len(edge.to_node.edges())
-            length = self.rest_length * (1.+1.5*(math.sqrt(num1) + math.sqrt(num2)))
-            length = max(length, length / (.5 + edge.strength))
+            length = self._edge_length(edge)
             color = "#eee"
             if edge.is_member():
                 color = "#bcf"
@@ -53,11 +94,19 @@ class NodeVis(object):
                 "length": length,
                 "color": color,
             }
-            ret.append(entry)
-        return ret
+            yield entry
+
+    def _edge_length(self, edge):
+        num1 = edge.from_node.degree()
+        num2 = edge.to_node.degree()
+        length = self.rest_length * (1.+1.5*(math.sqrt(num1) + math.sqrt(num2)))
+        return max(length, length / (.5 + edge.strength))
 
     def vis_infos(self):
-        infos = dict()
+        return dict(self.iter_vis_infos())
+
+    def iter_vis_infos(self):
+        """Yields (node id, info html) tuples"""
         for node in self.nodes.nodes.values():
             info = []
             def _addinfo(*ids):
@@ -77,20 +126,48 @@ class NodeVis(object):
             if node.is_repo():
                 info += ["repo: %s" % node["full_name"]]
                 _addinfo("fork", "stargazers_count", "open_issues_count", "forks_count", "size", "description")
+            if node.is_cluster():
+                info += ["%s repos of %s" % (node["num_repos"], node["login"])]
+                _addinfo("stargazers_count", "open_issues_count", "forks_count", "size")
+                info += [", ".join(node["repos"])]
+            for key in sorted(node.attrs):
+                value = node.attrs[key]
+                info.append("%s: %s" % (key, "%.4g" % value if isinstance(value, float) else value))
             for i in ("html_url", "blog"):
                 if i in node.obj and node[i]:
                     info = ['<a href="%s">%s</a>' % (node[i], node[i])] + info
-            infos[node.id] = "<br/>".join(info)
-        return infos
+            yield node.id, "<br/>".join(info)
 
     def write_html(self, fn):
-        html = self.get_html()
+        """Streams the html page to the file, without building it in memory"""
+        size = 0
         with open(fn, "w") as f:
-            f.write(html)
-        print("file://" + os.path.abspath(fn), " size:", len(html) // 1024, "kb")
+            for chunk in self._iter_html():
+                f.write(chunk)
+                size += len(chunk)
+        print("file://" + os.path.abspath(fn), " size:", size // 1024, "kb")
 
     def get_html(self):
-        html = """
+        return "".join(self._iter_html())
+
+    def _iter_html(self):
+        """Yields the html page in chunks, the %(name)s markers of HTML_TEMPLATE are replaced by json data"""
+        if self.layout and self.positions is None:
+            self.compute_layout()
+        data = {
+            "physics": lambda: _json(not self.positions),
+            "nodes": lambda: _iter_json_list(self.iter_vis_nodes()),
+            "edges": lambda: _iter_json_list(self.iter_vis_edges()),
+            "info": lambda: _iter_json_dict(self.iter_vis_infos()),
+        }
+        # odd entries are the marker names
+        for i, part in enumerate(re.split(r"%\((\w+)\)s", self.HTML_TEMPLATE)):
+            if i % 2:
+                yield from data[part]()
+            else:
+                yield part
+
+    HTML_TEMPLATE = """
         <!doctype html>
         <html>
         <head>
@@ -102,7 +179,7 @@ class NodeVis(object):
 
           <style type="text/css">
             #network {
-              width: 100%%;
+              width: 100%;
               height: 640px;
               border: 1px solid lightgray;
             }
@@ -130,6 +207,7 @@ class NodeVis(object):
                     }
                 },
                 interaction: {hover: true},
+                physics: %(physics)s,
                 layout: {
                     //improvedLayout: false
                     //, hierarchical: {enabled: true} 
@@ -151,9 +229,30 @@ class NodeVis(object):
         </script>    
         </body>
         </html>
-        """ % {
-            "nodes": self.vis_nodes(),
-            "edges": self.vis_edges(),
-            "info": self.vis_infos(),
-        }
-        return html
+        """
+
+
+def _json(value):
+    # a "</script>" in some user's bio must not end the script tag
+    return json.dumps(value).replace("</", "<\\/")
+
+
+def _iter_json_list(items):
+    yield "["
+    for i, item in enumerate(items):
+        if i:
+            yield ", "
+        yield _json(item)
+    yield "]"
+
+
+def _iter_json_dict(items):
+    """Yields a json object from (key, value) tuples"""
+    yield "{"
+    for i, (key, value) in enumerate(items):
+        if i:
+            yield ", "
+        yield _json(key)
+        yield ": "
+        yield _json(value)
+    yield "}"
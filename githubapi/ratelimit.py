@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    """
+    Token buckets per github rate-limit resource ("core", "search", ...)
+    which sync themselves from the X-RateLimit-* response headers.
+
+    Requests burst as long as a bucket has quota left.
+    An exhausted bucket sleeps exactly until its reset time.
+    All methods are thread-safe.
+    """
+
+    # (requests, window in seconds) assumed before the first response headers arrive
+    DEFAULT_LIMITS = {
+        "core": (5000, 3600),
+        "search": (30, 60),
+    }
+
+    class Bucket:
+        def __init__(self, limit, window):
+            self.limit = limit
+            self.window = window
+            self.remaining = limit
+            self.reset = time.time() + window
+            # requests that took a token but have not been answered yet
+            self.in_flight = 0
+            # closed by backoff() until then, the response headers don't shorten it
+            self.blocked_until = 0.
+
+        def as_dict(self):
+            if time.time() < self.blocked_until:
+                return {"limit": self.limit, "remaining": 0, "reset": self.blocked_until}
+            return {"limit": self.limit, "remaining": self.remaining, "reset": self.reset}
+
+    def __init__(self, limits=None):
+        """
+        :param limits: optional dict of resource -> (requests, window seconds)
+            to override DEFAULT_LIMITS
+        """
+        self._limits = dict(self.DEFAULT_LIMITS)
+        self._limits.update(limits or {})
+        self._buckets = dict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, resource):
+        if resource not in self._buckets:
+            limit, window = self._limits.get(resource, self._limits["core"])
+            self._buckets[resource] = RateLimiter.Bucket(limit, window)
+        return self._buckets[resource]
+
+    def acquire(self, resource="core"):
+        """
+        Takes one token from the bucket, sleeps until the reset time if it's empty.
+        Returns the number of seconds slept.
+        """
+        slept = 0.
+        while True:
+            wait_sec = self.try_acquire(resource)
+            if not wait_sec:
+                return slept
+            log.warning("%s rate limit exhausted, waiting %.1fs", resource, wait_sec)
+            time.sleep(wait_sec)
+            slept += wait_sec
+
+    def try_acquire(self, resource="core"):
+        """
+        Takes one token from the bucket without sleeping.
+        Returns 0 on success, otherwise the seconds until the bucket resets.
+        """
+        with self._lock:
+            bucket = self._bucket(resource)
+            now = time.time()
+            if now < bucket.blocked_until:
+                return max(1e-3, bucket.blocked_until - now)
+            if now >= bucket.reset:
+                bucket.remaining = bucket.limit
+                bucket.reset = now + bucket.window
+            if bucket.remaining > 0:
+                bucket.remaining -= 1
+                bucket.in_flight += 1
+                return 0
+            return max(1e-3, bucket.reset - now)
+
+    def remaining(self, resource="core"):
+        """Number of tokens left in the bucket, including a pending reset"""
+        with self._lock:
+            bucket = self._bucket(resource)
+            now = time.time()
+            if now < bucket.blocked_until:
+                return 0
+            return bucket.limit if now >= bucket.reset else bucket.remaining
+
+    def update(self, headers, resource="core"):
+        """
+        Must be called once per acquire() when the response (or None) arrived.
+        Syncs the bucket named in X-RateLimit-Resource from the response headers.
+        """
+        with self._lock:
+            bucket = self._bucket(resource)
+            bucket.in_flight = max(0, bucket.in_flight - 1)
+            if not headers or "X-RateLimit-Remaining" not in headers:
+                return
+            try:
+                remaining = int(headers["X-RateLimit-Remaining"])
+                limit = int(headers.get("X-RateLimit-Limit", remaining))
+                reset = float(headers.get("X-RateLimit-Reset", bucket.reset))
+            except ValueError:
+                return
+            bucket = self._bucket(headers.get("X-RateLimit-Resource", resource))
+            bucket.limit = limit
+            bucket.reset = reset
+            # the server does not know about the tokens taken by requests in flight
+            bucket.remaining = max(0, remaining - bucket.in_flight)
+
+    def backoff(self, resource, headers, default_sec):
+        """
+        Empties the bucket after a rate-limit error response.
+        The bucket stays closed for `Retry-After` seconds, until `X-RateLimit-Reset`
+        or, if the response has neither, for `default_sec` seconds,
+        also when responses of requests that were in flight arrive meanwhile.
+        """
+        now = time.time()
+        headers = headers or {}
+        if "Retry-After" in headers:
+            reset = now + float(headers["Retry-After"])
+        elif headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in headers:
+            reset = float(headers["X-RateLimit-Reset"])
+        else:
+            reset = now + default_sec
+        with self._lock:
+            bucket = self._bucket(headers.get("X-RateLimit-Resource", resource))
+            bucket.remaining = 0
+            bucket.reset = max(reset, now)
+            bucket.blocked_until = max(bucket.blocked_until, bucket.reset)
+
+    def budget(self, resource=None):
+        """
+        Returns the current state {"limit", "remaining", "reset"} of one resource
+        or a dict of all known resources
+        """
+        with self._lock:
+            if resource is not None:
+                return self._bucket(resource).as_dict()
+            return {name: bucket.as_dict() for name, bucket in self._buckets.items()}
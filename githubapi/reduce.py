@@ -0,0 +1,113 @@
+from .nodes import GithubNodes
+
+
+# repo fields summed up in a cluster node
+CLUSTER_SUM_FIELDS = ("stargazers_count", "forks_count", "open_issues_count", "size")
+
+
+def reduce_graph(nodes, collapse_degree=None, top_k_edges=None, min_degree=None):
+    """
+    Returns a smaller copy of a GithubNodes graph for display.
+    The node objects are shared with the original graph,
+    the reductions are applied in the order of the parameters.
+
+    :param collapse_degree: repos with at most this many edges are merged into
+        one cluster node "c:<owner>" per owner, if the owner has more than one such repo.
+        The edges of the merged repos are redirected to the cluster.
+    :param top_k_edges: keep only the edges that are among the k strongest of either of their nodes
+    :param min_degree: drop the nodes with fewer edges than this
+    :return: new GithubNodes instance
+    """
+    node_objs = {node_id: node.obj for node_id, node in nodes.nodes.items()}
+    # (from id, to id) -> [types, strength]
+    edges = {
+        key: [set(edge.types), edge.strength]
+        for key, edge in nodes.edges.items()
+    }
+
+    if collapse_degree is not None:
+        _collapse_repos(nodes, node_objs, edges, collapse_degree)
+
+    if top_k_edges is not None:
+        _keep_top_edges(edges, top_k_edges)
+
+    if min_degree is not None:
+        degree = dict()
+        for from_id, to_id in edges:
+            degree[from_id] = degree.get(from_id, 0) + 1
+            degree[to_id] = degree.get(to_id, 0) + 1
+        node_objs = {
+            node_id: obj for node_id, obj in node_objs.items()
+            if degree.get(node_id, 0) >= min_degree
+        }
+        edges = {
+            key: value for key, value in edges.items()
+            if key[0] in node_objs and key[1] in node_objs
+        }
+
+    reduced = GithubNodes(nodes.git, nodes.follow_depth)
+    reduced.set_state({
+        "nodes": node_objs.items(),
+        "edges": ((key[0], key[1], sorted(types), strength) for key, (types, strength) in edges.items()),
+    })
+    for node_id, node in reduced.nodes.items():
+        if node_id in nodes.nodes:
+            node.attrs = nodes.nodes[node_id].attrs
+    return reduced
+
+
+def _collapse_repos(nodes, node_objs, edges, collapse_degree):
+    # owner id -> ids of its low degree repos
+    owned = dict()
+    for node in nodes.nodes.values():
+        if node.is_repo() and node.degree() <= collapse_degree:
+            for edge in node.edges_in():
+                if edge.is_owner() or GithubNodes.E_FORKED in edge.types:
+                    owned.setdefault(edge.from_node.id, []).append(node.id)
+                    break
+
+    merged = dict()
+    for owner_id, repo_ids in owned.items():
+        if len(repo_ids) < 2:
+            continue
+        cluster_id = "c:" + owner_id[2:]
+        obj = {
+            "login": owner_id[2:],
+            "name": "%s/* (%s repos)" % (owner_id[2:], len(repo_ids)),
+            "num_repos": len(repo_ids),
+            "repos": sorted(node_objs[repo_id].get("full_name", repo_id[2:]) for repo_id in repo_ids),
+        }
+        for field in CLUSTER_SUM_FIELDS:
+            obj[field] = sum(node_objs[repo_id].get(field) or 0 for repo_id in repo_ids)
+        node_objs[cluster_id] = obj
+        for repo_id in repo_ids:
+            merged[repo_id] = cluster_id
+            del node_objs[repo_id]
+
+    if not merged:
+        return
+    # redirect the edges, parallel edges are joined like in GithubNodes._add_edge
+    for key in [key for key in edges if key[0] in merged or key[1] in merged]:
+        types, strength = edges.pop(key)
+        new_key = (merged.get(key[0], key[0]), merged.get(key[1], key[1]))
+        if new_key[0] == new_key[1]:
+            continue
+        if new_key in edges:
+            edges[new_key][0].update(types)
+            edges[new_key][1] += strength
+        else:
+            edges[new_key] = [types, strength]
+
+
+def _keep_top_edges(edges, k):
+    # node id -> keys of its edges
+    node_edges = dict()
+    for key in edges:
+        node_edges.setdefault(key[0], []).append(key)
+        node_edges.setdefault(key[1], []).append(key)
+    keep = set()
+    for keys in node_edges.values():
+        keys.sort(key=lambda key: edges[key][1], reverse=True)
+        keep.update(keys[:k])
+    for key in [key for key in edges if key not in keep]:
+        del edges[key]
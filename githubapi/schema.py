@@ -0,0 +1,158 @@
+"""
+Field schema of the cached documents.
+
+Only the fields that GithubNodes, NodeVis, the stats and the crawler use
+are stored as plain document fields. The rest of a github object is
+compressed into the `_blob` field, or dropped, and read back only on request.
+"""
+import json
+import zlib
+
+from .backends import TABLE_KEYS, BLOB_FIELD, field_tree
+
+# the fields of github objects that GithubNodes, NodeVis, the stats and the crawler use,
+# snapshot.SNAPSHOT_FIELDS is derived from them
+OWNER_FIELDS = ("login", "type", "avatar_url")
+
+ACCOUNT_FIELDS = (
+    "id", "login", "name", "type", "avatar_url", "html_url", "url", "blog", "description",
+    "created_at", "updated_at",
+    "hireable", "location", "company", "email", "bio",
+    "public_repos", "private_repos", "public_gists", "disk_usage", "following", "followers",
+)
+
+REPO_FIELDS = (
+    "id", "name", "full_name", "html_url", "url", "description", "created_at", "updated_at", "pushed_at",
+    "fork", "language", "size", "stargazers_count", "watchers_count", "open_issues_count", "forks_count",
+    "source", "parent",
+)
+
+# plain fields per table, the fields of the items for list tables, None keeps whole documents,
+# dotted names select fields of sub-objects, e.g. the owner of a repo
+CACHE_FIELDS = {
+    "user": ACCOUNT_FIELDS,
+    "org": ACCOUNT_FIELDS + ("members_url",),
+    "repo": REPO_FIELDS + tuple("owner." + name for name in OWNER_FIELDS),
+    # already reduced to the repo info by Github.get_repo_list
+    "repos": None,
+    "events": ("id", "type", "created_at", "repo.id", "repo.name"),
+    "members": ("login", "id", "type", "avatar_url"),
+    # already reduced by Github.get_repo_contributors
+    "contributors": None,
+}
+
+# fields of each cache document that are always kept
+INTERNAL_FIELDS = ("_id", "_etag", "_last_modified", "_cached_at", "ERROR")
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class CacheSchema(object):
+    """
+    Splits documents into the plain fields of CACHE_FIELDS and a compressed blob of the rest.
+
+    :param fields: dict of table -> field names, tables not in the dict keep whole documents
+    :param blob: keep the other fields in a compressed `_blob`, otherwise they are dropped
+    :param codec: "zlib" or "zstd" (needs the zstandard package)
+    """
+
+    def __init__(self, fields=CACHE_FIELDS, blob=True, codec="zlib", compress_level=6):
+        if codec not in ("zlib", "zstd"):
+            raise ValueError("codec must be 'zlib' or 'zstd', got %r" % (codec,))
+        self.fields = dict(fields or {})
+        self.blob = blob
+        self.codec = codec
+        self.compress_level = compress_level
+        self._trees = {table: field_tree(names) for table, names in self.fields.items() if names is not None}
+        self._compressor = None
+
+    def projection(self, table):
+        """Returns the list of (dotted) fields to read for the table, or None for whole documents"""
+        if table not in self._trees:
+            return None
+        prefix = "list." if self.is_list_table(table) else ""
+        keys = TABLE_KEYS.get(table, ("login",))
+        return list(keys) + list(INTERNAL_FIELDS) + [prefix + name for name in self.fields[table]]
+
+    @staticmethod
+    def is_list_table(table):
+        return table in ("repos", "events", "members", "contributors")
+
+    def pack(self, table, obj):
+        """
+        Returns the document with the plain fields only and
+        the compressed other fields (or None) as tuple
+        """
+        tree = self._trees.get(table)
+        if tree is None:
+            return obj, None
+        if self.is_list_table(table):
+            if not isinstance(obj.get("list"), list):
+                return obj, None
+            items, rests = [], []
+            for item in obj["list"]:
+                kept, rest = _split(item, tree)
+                items.append(kept)
+                rests.append(rest)
+            slim = dict(obj, list=items)
+            rest = rests if any(rests) else None
+        else:
+            keep = set(TABLE_KEYS.get(table, ("login",))) | set(INTERNAL_FIELDS)
+            slim, rest = _split(obj, tree, keep)
+        if not rest or not self.blob:
+            return slim, None
+        return slim, self._compress(json.dumps(rest, separators=(",", ":"), default=str).encode("utf-8"))
+
+    def unpack(self, table, obj):
+        """Returns the document with the fields of its blob merged back"""
+        blob = obj.get(BLOB_FIELD)
+        obj = {key: value for key, value in obj.items() if key != BLOB_FIELD}
+        if not blob:
+            return obj
+        rest = json.loads(self._decompress(bytes(blob)).decode("utf-8"))
+        if self.is_list_table(table):
+            obj["list"] = [_merge(item, item_rest) for item, item_rest in zip(obj.get("list") or [], rest)]
+            return obj
+        return _merge(obj, rest)
+
+    def _compress(self, data):
+        if self.codec == "zstd":
+            if self._compressor is None:
+                import zstandard
+                self._compressor = zstandard.ZstdCompressor(level=self.compress_level)
+            return self._compressor.compress(data)
+        return zlib.compress(data, self.compress_level)
+
+    @staticmethod
+    def _decompress(data):
+        if data.startswith(_ZSTD_MAGIC):
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+
+def _split(obj, tree, keep=()):
+    """Returns (the fields in tree, the other fields) of a dict"""
+    kept, rest = dict(), dict()
+    for key, value in obj.items():
+        if key in keep:
+            kept[key] = value
+        elif key not in tree:
+            if key != BLOB_FIELD:
+                rest[key] = value
+        elif tree[key] is None or not isinstance(value, dict):
+            kept[key] = value
+        else:
+            kept[key], sub_rest = _split(value, tree[key])
+            if sub_rest:
+                rest[key] = sub_rest
+    return kept, rest
+
+
+def _merge(obj, rest):
+    for key, value in rest.items():
+        if isinstance(value, dict) and isinstance(obj.get(key), dict):
+            obj[key] = _merge(dict(obj[key]), value)
+        else:
+            obj[key] = value
+    return obj
@@ -0,0 +1,162 @@
+"""
+Compact binary snapshots of a GithubNodes graph.
+
+File layout:
+    8 bytes         magic "GHNODES1"
+    4 bytes         little-endian length of the json header
+    header          json with counts, edge type names, byte order and section offsets
+    sections        8-byte aligned:
+        ids             utf-8 node ids separated by newlines
+        payload         utf-8 json list of the trimmed node objects
+        edge_from       int32 node index per edge
+        edge_to         int32 node index per edge
+        edge_types      uint16 bitmask of the header's edge types per edge
+        edge_strength   float64 per edge
+
+The numeric sections are read straight from the memory-mapped file.
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from .schema import CACHE_FIELDS, OWNER_FIELDS
+
+MAGIC = b"GHNODES1"
+
+# object fields kept in a snapshot: the plain fields of the cached users, orgs and repos
+SNAPSHOT_FIELDS = tuple(dict.fromkeys(
+    name.split(".")[0] for table in ("user", "org", "repo") for name in CACHE_FIELDS[table]
+)) + ("error", )
+
+
+def trim_object(obj, fields=SNAPSHOT_FIELDS):
+    """Returns a copy of the github object with only the given fields"""
+    ret = {key: obj[key] for key in fields if key in obj}
+    if isinstance(ret.get("owner"), dict):
+        ret["owner"] = {key: ret["owner"][key] for key in OWNER_FIELDS if key in ret["owner"]}
+    return ret
+
+
+def save_snapshot(nodes, filename, fields=SNAPSHOT_FIELDS):
+    """
+    Writes the graph of a GithubNodes instance to filename
+    :param fields: the object fields to keep, or None for all
+    """
+    node_ids = list(nodes.nodes)
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    edge_types = list(nodes.EDGE_TYPES)
+    type_bits = {name: 1 << i for i, name in enumerate(edge_types)}
+
+    edge_from, edge_to = array("i"), array("i")
+    edge_bits, edge_strength = array("H"), array("d")
+    for edge in nodes.edges.values():
+        edge_from.append(index[edge.from_node.id])
+        edge_to.append(index[edge.to_node.id])
+        mask = 0
+        for name in edge.types:
+            if name not in type_bits:
+                type_bits[name] = 1 << len(edge_types)
+                edge_types.append(name)
+            mask |= type_bits[name]
+        edge_bits.append(mask)
+        edge_strength.append(edge.strength)
+
+    payload = [
+        trim_object(node.obj, fields) if fields is not None else node.obj
+        for node in nodes.nodes.values()
+    ]
+    sections = [
+        ("ids", "\n".join(node_ids).encode("utf-8")),
+        ("payload", json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")),
+        ("edge_from", edge_from.tobytes()),
+        ("edge_to", edge_to.tobytes()),
+        ("edge_types", edge_bits.tobytes()),
+        ("edge_strength", edge_strength.tobytes()),
+    ]
+
+    header = {
+        "num_nodes": len(node_ids),
+        "num_edges": len(edge_from),
+        "edge_types": edge_types,
+        "byteorder": sys.byteorder,
+        "sections": {},
+    }
+    # section offsets depend on the header size, so place them relative to
+    # a header padded to a fixed size
+    offset = 0
+    for name, data in sections:
+        header["sections"][name] = [offset, len(data)]
+        offset += _padded(len(data))
+    header_data = json.dumps(header).encode("utf-8")
+    header_size = _padded(len(MAGIC) + 4 + len(header_data))
+
+    with open(filename, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_data)))
+        f.write(header_data)
+        f.write(b"\0" * (header_size - len(MAGIC) - 4 - len(header_data)))
+        for name, data in sections:
+            f.write(data)
+            f.write(b"\0" * (_padded(len(data)) - len(data)))
+
+
+def load_snapshot(nodes, filename):
+    """Replaces the graph of a GithubNodes instance with the snapshot in filename"""
+    with open(filename, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _load_snapshot(nodes, filename, mm)
+
+
+def _load_snapshot(nodes, filename, mm):
+    if mm[:len(MAGIC)] != MAGIC:
+        raise ValueError("%s is not a GithubNodes snapshot" % filename)
+    header_len = struct.unpack("<I", mm[len(MAGIC):len(MAGIC) + 4])[0]
+    header = json.loads(mm[len(MAGIC) + 4:len(MAGIC) + 4 + header_len].decode("utf-8"))
+    base = _padded(len(MAGIC) + 4 + header_len)
+
+    def _section(name):
+        offset, length = header["sections"][name]
+        return mm[base + offset:base + offset + length]
+
+    node_ids = _section("ids").decode("utf-8").split("\n") if header["num_nodes"] else []
+    payload = json.loads(_section("payload").decode("utf-8"))
+
+    view = memoryview(mm)
+    columns = []
+    try:
+        for name, typecode in (("edge_from", "i"), ("edge_to", "i"), ("edge_types", "H"), ("edge_strength", "d")):
+            offset, length = header["sections"][name]
+            columns.append(_array(view[base + offset:base + offset + length], typecode, header["byteorder"]))
+
+        # the bits of the header's edge types -> the bits of GithubNodes
+        type_names = header["edge_types"]
+        masks = {
+            mask: nodes._type_mask(name for bit, name in enumerate(type_names) if mask & (1 << bit))
+            for mask in set(columns[2])
+        }
+        edge_types = columns[2]
+        if any(mask != bits for mask, bits in masks.items()):
+            edge_types = [masks[mask] for mask in edge_types]
+
+        nodes._set_graph(node_ids, payload, columns[0], columns[1], edge_types, columns[3])
+    finally:
+        # release the buffer exports before the mmap is closed
+        for column in columns:
+            if isinstance(column, memoryview):
+                column.release()
+        view.release()
+
+
+def _padded(size, alignment=8):
+    return (size + alignment - 1) // alignment * alignment
+
+
+def _array(data, typecode, byteorder):
+    """Returns the section as typed memoryview, or as a swapped copy if written with another byte order"""
+    if byteorder == sys.byteorder:
+        return data.cast(typecode)
+    values = array(typecode, bytes(data))
+    values.byteswap()
+    return values
@@ -1,40 +1,163 @@
+import math
+
+import numpy as np
+
+__all__ = ["Stats", "RepoStats", "OrganisationStats", "UserStats"]
+
 
 class Stats(object):
+    """
+    Columnar statistics over github objects.
+
+    Each attribute of `attr` is stored as a column: attributes with a numeric
+    default as a float numpy array (missing values are NaN), all others as a
+    list of values. Dict values like a repo's "owner" are stored by their "login".
+    The objects themselves are not kept.
+    """
 
     def __init__(self, name, attr):
         self.name = name
-        self.objects = []
-        self.stats_sum = dict(attr)
+        self.attr = dict(attr)
+        self.count = 0
+        self._numeric = [key for key, value in self.attr.items()
+                         if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        self._columns = {key: np.zeros(16) if key in self._numeric else [] for key in self.attr}
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def stats_sum(self):
+        """Sum of each numeric attribute, the value or the list of values of the others"""
+        ret = dict()
+        for key in self.attr:
+            if key in self._numeric:
+                ret[key] = self.sum(key)
+            elif self.count == 1:
+                ret[key] = self._columns[key][0]
+            else:
+                ret[key] = list(self._columns[key])
+        return ret
 
     def dump(self):
         ret = ""
-        if len(self.objects) > 1:
-            ret += "num %s: %s\n" % (self.name, len(self.objects))
+        if self.count > 1:
+            ret += "num %s: %s\n" % (self.name, self.count)
         else:
             ret += "%s\n" % self.name
-        for key in sorted(self.stats_sum):
-            ret += "%20s: %s\n" % (key, self.stats_sum[key])
+        for key in sorted(self.attr):
+            if key in self._numeric:
+                value = self.sum(key)
+            elif self.count == 1:
+                value = self._columns[key][0]
+            else:
+                value = "%s distinct" % len(set(self._columns[key]))
+            ret += "%20s: %s\n" % (key, value)
         print(ret)
         return ret
 
     def add_object(self, obj):
-        assert isinstance(obj, dict)
-        self.objects.append(obj)
-        for key in self.stats_sum:
-            cur_val = self.stats_sum[key]
-            if isinstance(cur_val, (int, float)):
-                self.stats_sum[key] += obj.get(key, 0)
-            elif isinstance(cur_val, list):
-                self.stats_sum[key].append(obj.get(key))
-            else:
-                if len(self.objects) == 1:
-                    self.stats_sum[key] = obj.get(key)
-                else:
-                    self.stats_sum[key] = [cur_val, obj.get(key)]
+        self.add_objects([obj])
 
     def add_objects(self, objs):
-        for i in objs:
-            self.add_object(i)
+        objs = list(objs)
+        for obj in objs:
+            assert isinstance(obj, dict)
+        count = self.count + len(objs)
+        for key in self.attr:
+            if key in self._numeric:
+                column = self._columns[key]
+                if count > len(column):
+                    column = np.resize(column, max(count, 2 * len(column)))
+                    self._columns[key] = column
+                column[self.count:count] = [_number(obj.get(key)) for obj in objs]
+            else:
+                self._columns[key] += [_value(obj.get(key)) for obj in objs]
+        self.count = count
+
+    def column(self, key):
+        """Returns the values of an attribute, a numpy array for numeric attributes or a list"""
+        if key in self._numeric:
+            return self._columns[key][:self.count]
+        return self._columns[key]
+
+    def sum(self, key=None):
+        """Sum of a numeric attribute, or dict of the sums of all numeric attributes"""
+        return self._aggregate(key, np.nansum)
+
+    def mean(self, key=None):
+        return self._aggregate(key, np.nanmean)
+
+    def median(self, key=None):
+        return self._aggregate(key, np.nanmedian)
+
+    def percentile(self, key=None, q=90):
+        """The q-th percentile, q can be a number or a list of numbers in [0, 100]"""
+        return self._aggregate(key, lambda values: np.nanpercentile(values, q))
+
+    def _aggregate(self, key, func):
+        if key is None:
+            return {key: self._aggregate(key, func) for key in self._numeric}
+        values = self.column(key)
+        if not len(values) or np.isnan(values).all():
+            return float("nan") if func is not np.nansum else 0
+        value = func(values)
+        if np.ndim(value):
+            return value.tolist()
+        if func is np.nansum and isinstance(self.attr[key], int):
+            return int(value)
+        return float(value)
+
+    def group_by(self, key):
+        """
+        Returns a dict of attribute value -> Stats of the objects with this value,
+        largest groups first. Missing numeric values are grouped under None.
+        """
+        values = self.column(key)
+        if key in self._numeric:
+            values = [_plain_number(value, self.attr[key]) for value in values.tolist()]
+        groups = dict()
+        codes = np.fromiter((groups.setdefault(value, len(groups)) for value in values),
+                            dtype=np.int64, count=self.count)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(groups) + 1))
+        ret = [(value, self._subset(order[bounds[code]:bounds[code + 1]])) for value, code in groups.items()]
+        ret.sort(key=lambda item: -item[1].count)
+        return dict(ret)
+
+    def _subset(self, indices):
+        stats = self.__class__.__new__(self.__class__)
+        stats.name = self.name
+        stats.attr = self.attr
+        stats.count = len(indices)
+        stats._numeric = self._numeric
+        stats._columns = {
+            key: self._columns[key][indices] if key in self._numeric
+            else [self._columns[key][i] for i in indices]
+            for key in self.attr
+        }
+        return stats
+
+
+def _number(value):
+    if value is None or isinstance(value, str):
+        return np.nan
+    return value
+
+
+def _plain_number(value, default):
+    """The python value of a numeric column entry, None for missing values"""
+    if math.isnan(value):
+        return None
+    if isinstance(default, int) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _value(value):
+    if isinstance(value, dict):
+        return value.get("login")
+    return value
 
 
 class RepoStats(Stats):
@@ -45,6 +168,9 @@ class RepoStats(Stats):
             'watchers_count': 0,
             'forks_count': 0,
             'size': 0,
+            'full_name': '',
+            'language': '',
+            'owner': '',
         })
 
 
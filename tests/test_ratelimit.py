@@ -0,0 +1,48 @@
+import time
+
+from githubapi import RateLimiter
+
+
+def _headers(remaining, reset_in=3600, limit=5000):
+    return {
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(time.time() + reset_in),
+    }
+
+
+def test_update_syncs_bucket():
+    limiter = RateLimiter()
+    assert limiter.try_acquire() == 0
+    limiter.update(_headers(4000))
+    assert limiter.remaining() == 4000
+
+
+def test_backoff_closes_bucket():
+    limiter = RateLimiter()
+    limiter.backoff("core", {"Retry-After": "60"}, 10)
+    assert limiter.remaining() == 0
+    assert 59 < limiter.try_acquire() <= 60
+
+
+def test_late_response_does_not_reopen_backoff():
+    limiter = RateLimiter()
+    # two requests in flight, the first one hits the secondary limit
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() == 0
+    limiter.update({"Retry-After": "60"})
+    limiter.backoff("core", {"Retry-After": "60"}, 10)
+    # the second one was answered by the server before the limit
+    limiter.update(_headers(4000, reset_in=1800))
+    assert limiter.remaining() == 0
+    assert 59 < limiter.try_acquire() <= 60
+    assert limiter.budget("core")["remaining"] == 0
+
+
+def test_backoff_expires():
+    limiter = RateLimiter()
+    limiter.backoff("core", {"Retry-After": "0.05"}, 10)
+    limiter.update(_headers(4000))
+    assert limiter.try_acquire() > 0
+    time.sleep(0.06)
+    assert limiter.try_acquire() == 0
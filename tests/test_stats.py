@@ -0,0 +1,31 @@
+from githubapi import RepoStats
+
+
+def test_group_by_numeric_with_missing_values():
+    stats = RepoStats()
+    stats.add_objects([
+        {"full_name": "a/x", "size": 5},
+        {"full_name": "a/y", "size": None},
+        {"full_name": "b/x", "size": 5},
+        {"full_name": "b/y"},
+        {"full_name": "b/z", "size": 7},
+    ])
+    groups = stats.group_by("size")
+    assert list(groups) == [5, None, 7]
+    assert all(type(value) is int for value in groups if value is not None)
+    assert groups[5].column("full_name") == ["a/x", "b/x"]
+    assert groups[None].column("full_name") == ["a/y", "b/y"]
+    assert groups[7].count == 1
+
+
+def test_group_by_values():
+    stats = RepoStats()
+    stats.add_objects([
+        {"language": "Python", "owner": {"login": "a"}, "stargazers_count": 1},
+        {"language": "C", "owner": {"login": "b"}, "stargazers_count": 2},
+        {"language": "Python", "owner": {"login": "b"}, "stargazers_count": 3},
+    ])
+    groups = stats.group_by("language")
+    assert list(groups) == ["Python", "C"]
+    assert groups["Python"].sum("stargazers_count") == 4
+    assert list(stats.group_by("owner")) == ["b", "a"]